@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Benchmark: compiled TagExtractor vs the old per-keyword substring scan
+
+Usage:
+    python benchmarks/bench_tag_extractor.py [titles.txt | state.json | state.db]
+
+Titles are read one per line from a text file or from the pending posts of a
+state.json / state.db. By default the bundled titles.txt is used: headlines
+of real releases as the feeds publish them.
+"""
+import json
+import sqlite3
+import sys
+import timeit
+import types
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+# hypebot/__init__.py wires up the whole bot; the tag extractor only needs
+# config and models, so the package is registered without running it
+_package = types.ModuleType("hypebot")
+_package.__path__ = [str(ROOT / "hypebot")]
+sys.modules.setdefault("hypebot", _package)
+
+from hypebot.config.constants import (
+    BRAND_KEYWORDS, MODEL_KEYWORDS, RELEASE_TYPES, COLOR_KEYWORDS
+)
+from hypebot.services.tag_extractor import TagExtractor, COLOR_MAP
+
+DEFAULT_TITLES = Path(__file__).resolve().parent / "titles.txt"
+
+
+def legacy_extract(title: str, context: str = "") -> dict:
+    """Previous implementation: substring scan per keyword"""
+    text = f"{title} {context}".lower()
+    result = {"brands": [], "models": [], "types": [], "colors": []}
+    for field, table in (("brands", BRAND_KEYWORDS), ("models", MODEL_KEYWORDS), ("types", RELEASE_TYPES)):
+        for tag, keywords in table.items():
+            if any(keyword in text for keyword in keywords):
+                result[field].append(tag)
+    for color in COLOR_KEYWORDS:
+        if color in text:
+            english = COLOR_MAP.get(color, color)
+            if english not in result["colors"]:
+                result["colors"].append(english)
+    return result
+
+
+def load_titles(path: str) -> list:
+    """Load titles from text file, state.json or state.db"""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        return [post["title"] for post in state.get("pending", {}).values()]
+    if path.endswith(".db"):
+        conn = sqlite3.connect(path)
+        try:
+            rows = conn.execute("SELECT data FROM pending_posts").fetchall()
+        finally:
+            conn.close()
+        return [json.loads(data)["title"] for data, in rows]
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    titles = load_titles(sys.argv[1] if len(sys.argv) > 1 else str(DEFAULT_TITLES))
+    print(f"Titles: {len(titles)}")
+    
+    legacy = timeit.timeit(lambda: [legacy_extract(t) for t in titles], number=5) / 5
+    compiled = timeit.timeit(lambda: [TagExtractor.extract_tags(t) for t in titles], number=5) / 5
+    
+    print(f"Legacy substring scan: {legacy * 1000:.1f} ms")
+    print(f"Compiled matcher:      {compiled * 1000:.1f} ms")
+    print(f"Speedup:               {legacy / compiled:.1f}x")
+    
+    # The compiled matcher is a drop-in replacement: every field must match
+    changed = {field: 0 for field in ("brands", "models", "types", "colors")}
+    examples = {}
+    for title in titles:
+        legacy_tags = legacy_extract(title)
+        tags = TagExtractor.extract_tags(title).to_dict()
+        for field in changed:
+            if legacy_tags[field] != tags[field]:
+                changed[field] += 1
+                examples.setdefault(field, (title, legacy_tags[field], tags[field]))
+    
+    print("Titles with different tags, by field:")
+    for field, count in changed.items():
+        print(f"  {field:<7} {count}")
+        if field in examples:
+            title, before, after = examples[field]
+            print(f"          e.g. {title!r}: {before} -> {after}")
+    
+    if any(changed.values()):
+        sys.exit("Tags differ from the substring scan")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Bot application lifecycle
+"""
+from typing import List, Optional
+
+from telegram.ext import Application, ApplicationBuilder
+
+from .models.post import Post
+from .services.ai_service import AIService
+from .services.caption_pipeline import CaptionPregenerator
+from .services.image_service import ImageService
+from .services.publisher import PublisherService
+from .services.state_manager import StateManager
+
+
+def add_lifecycle_hooks(
+    builder: ApplicationBuilder,
+    state_manager: StateManager,
+    ai_service: AIService,
+    publisher: PublisherService
+) -> ApplicationBuilder:
+    """Attach service start-up and shutdown to the application being built"""
+    
+    async def post_init(application: Application) -> None:
+        # Outbox recovery and the publishing loops need the running event loop
+        await publisher.start()
+    
+    async def post_shutdown(application: Application) -> None:
+        await publisher.stop()
+        
+        # Cache and state writes still waiting in the debounce window reach the disk
+        await ai_service.close()
+        await state_manager.close()
+    
+    return builder.post_init(post_init).post_shutdown(post_shutdown)
+
+
+async def queue_fetched_posts(
+    posts: List[Post],
+    state_manager: StateManager,
+    image_service: Optional[ImageService] = None,
+    pregenerator: Optional[CaptionPregenerator] = None
+) -> List[Post]:
+    """Queue posts from ContentFetcher.fetch_all for moderation
+    
+    Stages that need the post in the queue run after it is added: lead
+    images of the posts that were kept are indexed for duplicate checks
+    and their captions are pre-generated in background. Returns those posts.
+    """
+    for post in posts:
+        state_manager.add_pending_post(post)
+    
+    # The queue trims itself to its size limit, the oldest posts may be gone already
+    queued = [post for post in posts if state_manager.has_pending_post(post.id)]
+    
+    if image_service is not None:
+        await image_service.index_images(queued)
+    
+    if pregenerator is not None and queued:
+        pregenerator.start(queued)
+    
+    return queued
@@ -6,8 +6,8 @@ from .settings import BotConfig, IMAGE_STYLES, setup_logging
 from .constants import (
     HASHTAGS, BRAND_KEYWORDS, MODEL_KEYWORDS, RELEASE_TYPES,
     SOURCE_EMOJIS, AVAILABLE_TIMEZONES, COLOR_KEYWORDS,
-    VALID_IMAGE_EXTENSIONS, OPENAI_MODELS,
-    CAPTION_SYSTEM_PROMPT, THOUGHTS_SYSTEM_PROMPT
+    VALID_IMAGE_EXTENSIONS, TRACKING_QUERY_PARAMS, OPENAI_MODELS,
+    CAPTION_SYSTEM_PROMPT, THOUGHTS_SYSTEM_PROMPT, CAPTION_PROMPT_VERSION
 )
 from .sources import SOURCES, DEFAULT_HEADERS, SNEAKER_KEYWORDS
 
@@ -15,7 +15,7 @@ __all__ = [
     'BotConfig', 'IMAGE_STYLES', 'setup_logging',
     'HASHTAGS', 'BRAND_KEYWORDS', 'MODEL_KEYWORDS', 'RELEASE_TYPES',
     'SOURCE_EMOJIS', 'AVAILABLE_TIMEZONES', 'COLOR_KEYWORDS',
-    'VALID_IMAGE_EXTENSIONS', 'OPENAI_MODELS',
-    'CAPTION_SYSTEM_PROMPT', 'THOUGHTS_SYSTEM_PROMPT',
+    'VALID_IMAGE_EXTENSIONS', 'TRACKING_QUERY_PARAMS', 'OPENAI_MODELS',
+    'CAPTION_SYSTEM_PROMPT', 'THOUGHTS_SYSTEM_PROMPT', 'CAPTION_PROMPT_VERSION',
     'SOURCES', 'DEFAULT_HEADERS', 'SNEAKER_KEYWORDS'
 ]
\ No newline at end of file
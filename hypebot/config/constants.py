@@ -104,9 +104,17 @@ COLOR_KEYWORDS = [
 # Validation patterns
 VALID_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
 
+# Query parameters stripped from links before deduplication (plus any utm_*)
+TRACKING_QUERY_PARAMS = (
+    'fbclid', 'gclid', 'yclid', 'mc_cid', 'mc_eid', 'igshid', 'ref', 'ref_src'
+)
+
 # API Models fallback order
 OPENAI_MODELS = ["gpt-4o", "gpt-4-turbo", "gpt-4", "gpt-3.5-turbo"]
 
+# Bump when caption prompts change to invalidate cached captions
+CAPTION_PROMPT_VERSION = 1
+
 # System prompts
 CAPTION_SYSTEM_PROMPT = """Ты — автор Telegram-канала про кроссовки и уличную моду. Твоя задача — писать короткие, цепляющие и стильные посты о релизах, трендах и коллаборациях. 
 
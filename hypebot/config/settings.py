@@ -17,6 +17,18 @@ class BotConfig:
     
     # File paths
     state_file: str = "state.json"
+    feed_cache_file: str = "feed_cache.json"
+    state_db_file: str = "state.db"
+    caption_cache_file: str = "caption_cache.json"
+    vision_cache_file: str = "vision_cache.json"
+    image_cache_dir: str = "image_cache"
+    
+    # State backend: "json" or "sqlite"
+    state_backend: str = "json"
+    
+    # State journal
+    state_journal_max_records: int = 500
+    state_flush_delay_seconds: float = 1.0
     
     # Intervals
     check_interval_seconds: int = 1800
@@ -25,6 +37,58 @@ class BotConfig:
     max_pending_posts: int = 100
     max_post_age_days: int = 7
     max_images_per_post: int = 10
+    max_sent_links: int = 5000
+    sent_links_max_age_days: int = 90
+    max_file_ids: int = 2000
+    
+    # Fetching
+    fetch_concurrency: int = 5
+    fetch_timeout_seconds: float = 20.0
+    
+    # Caption cache
+    caption_cache_max_entries: int = 1000
+    caption_cache_ttl_days: int = 30
+    
+    # Vision analysis: cached descriptions, longest side of uploaded image
+    vision_cache_max_entries: int = 500
+    vision_max_side: int = 1024
+    
+    # Model fallback: start next model if no answer after delay (0 = sequential)
+    ai_hedge_delay_seconds: float = 8.0
+    ai_model_timeout_seconds: float = 40.0
+    
+    # OpenAI rate limits per call kind (requests / tokens per minute)
+    ai_text_rpm: int = 500
+    ai_text_tpm: int = 30000
+    ai_image_rpm: int = 5
+    ai_vision_rpm: int = 100
+    ai_vision_tpm: int = 30000
+    ai_max_retries: int = 3
+    
+    # Image cache
+    image_cache_max_bytes: int = 500 * 1024 * 1024
+    image_download_timeout_seconds: float = 20.0
+    
+    # Image preprocessing before upload: longest side, "JPEG" or "WEBP", quality
+    image_max_side: int = 1280
+    image_format: str = "JPEG"
+    image_quality: int = 85
+    image_workers: int = 4
+    
+    # Near-duplicate stories by perceptual hash of lead images
+    image_dedup_max_distance: int = 6
+    image_dedup_lead_images: int = 2
+    image_dedup_days: int = 14
+    
+    # Near-duplicate stories by title similarity (Jaccard of title words and tags)
+    title_cluster_threshold: float = 0.5
+    
+    # Queue ranking: freshness half-life and weight of brand/model popularity
+    score_half_life_hours: float = 12.0
+    score_hotness_weight: float = 0.5
+    
+    # Caption pre-generation for fetched posts
+    caption_pregen_concurrency: int = 3
     
     # Timezone
     default_timezone: str = "Europe/Moscow"
@@ -40,4 +40,17 @@ SOURCES = [
         "api": "https://www.highsnobiety.com/tag/fashion/feed/",
         "category": "fashion"
     }
-]
\ No newline at end of file
+]
+
+# Заголовки HTTP-запросов к источникам
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+}
+
+# Ключевые слова для отбора кроссовочных постов из общих RSS-лент
+SNEAKER_KEYWORDS = [
+    "nike", "adidas", "jordan", "yeezy", "new balance", "puma",
+    "reebok", "vans", "converse", "asics", "sneaker", "shoe",
+    "footwear", "release", "drop", "collab", "air max", "dunk",
+    "trainer", "runner", "retro"
+]
@@ -109,7 +109,7 @@ class CallbackHandler(BaseHandler):
         """Handle settings callbacks"""
         if data == "settings_channel":
             self.state.waiting.waiting_for_channel = True
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             await update.callback_query.edit_message_text(
                 "📢 <b>Изменение канала публикации</b>\n\n"
@@ -171,14 +171,14 @@ class CallbackHandler(BaseHandler):
             self.state.pending.clear()
             self.state.preview_mode = None
             self.state.generated_images.clear()
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             await update.callback_query.edit_message_text(f"🗑 Очищено {count} постов из очереди")
         
         elif data == "clean_sent":
             count = len(self.state.sent_links)
             self.state.sent_links.clear()
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             await update.callback_query.edit_message_text(f"🗑 Очищен список обработанных: {count} записей")
     
@@ -191,25 +191,16 @@ class CallbackHandler(BaseHandler):
     
     async def _test_sources_inline(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Test all sources"""
-        from ..config.sources import SOURCES
-        
         results = []
         
-        for idx, source in enumerate(SOURCES):
-            try:
-                await update.callback_query.edit_message_text(
-                    f"🔍 Тестирую источники... ({idx + 1}/{len(SOURCES)})\n📍 {source['name']}"
-                )
-                
-                # Simple connectivity test
-                import httpx
-                async with httpx.AsyncClient() as client:
-                    resp = await client.get(source["api"], timeout=10)
-                    status = "✅" if resp.status_code == 200 else f"❌ {resp.status_code}"
-                    results.append(f"{status} {source['name']} ({source['category']})")
-            
-            except Exception as e:
-                results.append(f"❌ {source['name']}: {type(e).__name__}")
+        # All sources are checked at once over the fetcher's shared client
+        for check in await self.content_fetcher.test_sources():
+            source = check["source"]
+            if check["error"]:
+                results.append(f"❌ {source['name']}: {check['error']}")
+            else:
+                status = "✅" if check["status_code"] == 200 else f"❌ {check['status_code']}"
+                results.append(f"{status} {source['name']} ({source['category']})")
         
         # Final results
         final_text = "📊 <b>Результаты тестирования:</b>\n\n" + "\n".join(results)
@@ -230,7 +221,7 @@ class CallbackHandler(BaseHandler):
         if data.startswith("schedule:"):
             uid = data.split(":")[1]
             self.state.waiting.waiting_for_schedule = uid
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             user_tz = pytz.timezone(self.state.timezone)
             await update.callback_query.edit_message_text(
@@ -250,7 +241,7 @@ class CallbackHandler(BaseHandler):
         elif data.startswith("edit_schedule:"):
             post_id = data.split(":")[1]
             self.state.waiting.editing_schedule = post_id
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             schedule_info = self.state.scheduled_posts.get(post_id)
             if schedule_info:
@@ -318,12 +309,8 @@ class CallbackHandler(BaseHandler):
             await self._filter_posts_by_tag(update, context, filter_type, filter_value)
         
         elif data == "filter_reset":
-            # Reset filters
-            preview_list = sorted(
-                self.state.pending.keys(),
-                key=lambda x: self.state.pending[x].timestamp,
-                reverse=True
-            )
+            # Reset filters, most relevant posts first
+            preview_list = self.state_manager.get_top_pending_ids()
             
             from ..models.state import PreviewMode
             self.state.preview_mode = PreviewMode(
@@ -331,7 +318,7 @@ class CallbackHandler(BaseHandler):
                 current=0,
                 filter=None
             )
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             await update.callback_query.edit_message_text("✅ Фильтры сброшены")
             
@@ -358,7 +345,7 @@ class CallbackHandler(BaseHandler):
     
     async def _show_filter_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Show filter menu"""
-        all_tags = self.tag_extractor.get_all_unique_tags(self.state.pending)
+        all_tags = self.state_manager.get_pending_tags()
         
         keyboard_buttons = []
         
@@ -412,29 +399,20 @@ class CallbackHandler(BaseHandler):
     
     async def _filter_posts_by_tag(self, update: Update, context: ContextTypes.DEFAULT_TYPE, tag_type: str, tag_value: str):
         """Filter posts by tag"""
-        filtered_posts = []
-        
-        for uid, post in self.state.pending.items():
-            if post.tags and self.tag_extractor.matches_filter(post.tags, tag_type, tag_value):
-                filtered_posts.append(uid)
+        # Index returns newest first
+        filtered_posts = self.state_manager.find_pending_ids([(tag_type, tag_value)])
         
         if not filtered_posts:
             await update.callback_query.edit_message_text(f"📭 Нет постов с тегом {tag_value}")
             return
         
-        # Sort by date
-        filtered_posts.sort(
-            key=lambda x: self.state.pending[x].timestamp,
-            reverse=True
-        )
-        
         from ..models.state import PreviewMode
         self.state.preview_mode = PreviewMode(
             list=filtered_posts,
             current=0,
             filter={tag_type: tag_value}
         )
-        self.save_state()
+        self.state_manager.mark_dirty()
         
         await update.callback_query.edit_message_text(
             f"✅ Найдено {len(filtered_posts)} постов с тегом {tag_value}"
@@ -539,7 +517,7 @@ class CallbackHandler(BaseHandler):
             if data.startswith("custom_prompt:"):
                 # Wait for custom prompt
                 self.state.waiting.waiting_for_prompt = uid
-                self.save_state()
+                self.state_manager.mark_dirty()
                 
                 await update.callback_query.edit_message_text(
                     "✏️ <b>Создание кастомной обложки</b>\n\n"
@@ -563,6 +541,8 @@ class CallbackHandler(BaseHandler):
                 image_url = await self.ai_service.generate_image(prompt)
                 
                 if image_url:
+                    # DALL-E urls expire, keep a local copy right away
+                    await self.image_service.prefetch([image_url])
                     self.state_manager.add_generated_image(uid, image_url)
                     await update.callback_query.message.edit_text("✅ Обложка сгенерирована!")
                     
@@ -598,9 +578,10 @@ class CallbackHandler(BaseHandler):
                 image_url = await self.ai_service.generate_image(prompt)
                 
                 if image_url:
+                    await self.image_service.prefetch([image_url])
                     thought_data.image_url = image_url
                     self.state.current_thought = thought_data
-                    self.save_state()
+                    self.state_manager.mark_dirty()
                     
                     keyboard = InlineKeyboardMarkup([
                         [InlineKeyboardButton("📤 Опубликовать", callback_data="publish_thought")],
@@ -633,7 +614,7 @@ class CallbackHandler(BaseHandler):
             if success:
                 await update.callback_query.edit_message_text("✅ Мысли опубликованы!")
                 self.state.current_thought = None
-                self.save_state()
+                self.state_manager.mark_dirty()
             else:
                 await update.callback_query.edit_message_text("❌ Ошибка публикации")
         
@@ -654,7 +635,7 @@ class CallbackHandler(BaseHandler):
             
             thought_data.text = final_text
             self.state.current_thought = thought_data
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             keyboard = InlineKeyboardMarkup([
                 [InlineKeyboardButton("📤 Опубликовать", callback_data="publish_thought")],
@@ -672,7 +653,7 @@ class CallbackHandler(BaseHandler):
         elif data == "cancel_thought":
             await update.callback_query.message.delete()
             self.state.current_thought = None
-            self.save_state()
+            self.state_manager.mark_dirty()
     
     @admin_only(None)
     async def _handle_moderation_callbacks(self, update: Update, context: ContextTypes.DEFAULT_TYPE, data: str):
@@ -707,15 +688,16 @@ class CallbackHandler(BaseHandler):
         elif action == "regen":
             await update.callback_query.edit_message_text(f"🔄 Регенерирую описание для: {post.title[:50]}...")
             
-            # Regenerate caption
+            # Regenerate caption, bypassing the cached one
             new_description = await self.ai_service.generate_caption(
                 post.title,
                 post.context,
-                post.category
+                post.category,
+                use_cache=False
             )
             
             post.description = new_description
-            self.save_state()
+            self.state_manager.mark_dirty()
             
             # Send back for moderation
             await self.publisher_service.send_for_moderation(
@@ -49,6 +49,8 @@ class Post:
     original_images: List[str] = field(default_factory=list)
     tags: Optional[PostTags] = None
     needs_parsing: bool = True
+    # Same story from other feeds: [{"source": ..., "link": ...}]
+    duplicates: List[Dict[str, str]] = field(default_factory=list)
     
     def __post_init__(self):
         """Post initialization"""
@@ -73,7 +75,8 @@ class Post:
             "images": self.images,
             "original_images": self.original_images,
             "tags": self.tags.to_dict() if self.tags else {},
-            "needs_parsing": self.needs_parsing
+            "needs_parsing": self.needs_parsing,
+            "duplicates": self.duplicates
         }
     
     @classmethod
@@ -94,7 +97,8 @@ class Post:
             images=data.get("images", []),
             original_images=data.get("original_images", []),
             tags=tags,
-            needs_parsing=data.get("needs_parsing", True)
+            needs_parsing=data.get("needs_parsing", True),
+            duplicates=data.get("duplicates", [])
         )
     
     def get_hashtags(self) -> str:
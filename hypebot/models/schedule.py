@@ -3,7 +3,7 @@ Scheduling models
 """
 from dataclasses import dataclass
 from typing import Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 
 from .post import Post
 
@@ -18,6 +18,13 @@ class ScheduledPost:
         """Get scheduled datetime"""
         return datetime.fromisoformat(self.time.replace('Z', '+00:00'))
     
+    def get_timestamp(self) -> float:
+        """Get scheduled time as epoch seconds (naive time is UTC)"""
+        scheduled = self.get_datetime()
+        if scheduled.tzinfo is None:
+            scheduled = scheduled.replace(tzinfo=timezone.utc)
+        return scheduled.timestamp()
+    
     def is_ready(self) -> bool:
         """Check if post is ready to be published"""
         return datetime.utcnow() >= self.get_datetime()
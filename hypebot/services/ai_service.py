@@ -1,13 +1,270 @@
 """
 AI service for text and image generation
 """
+import asyncio
 import base64
+import hashlib
+import json
 import logging
-from typing import Optional, List
-from openai import AsyncOpenAI
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, List
+from openai import AsyncOpenAI, RateLimitError
 
 from ..config.settings import BotConfig, IMAGE_STYLES
-from ..config.constants import CAPTION_SYSTEM_PROMPT, THOUGHTS_SYSTEM_PROMPT, OPENAI_MODELS
+from ..config.constants import (
+    CAPTION_SYSTEM_PROMPT, THOUGHTS_SYSTEM_PROMPT, OPENAI_MODELS, CAPTION_PROMPT_VERSION
+)
+from ..services.rate_limiter import RequestScheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from ..utils.image_processing import preprocess_image
+
+
+# Rough chars per token for mixed Russian/English text
+CHARS_PER_TOKEN = 3
+
+# Completion limit for post captions
+CAPTION_MAX_TOKENS = 300
+
+# Approximate prompt cost of one image in vision requests
+VISION_IMAGE_TOKENS = 1000
+
+VISION_PROMPT = (
+    "Опиши что изображено на этой картинке. "
+    "Особое внимание удели деталям, цветам, стилю. "
+    "Если это кроссовки или одежда - опиши модель, бренд, особенности дизайна."
+)
+
+
+def estimate_tokens(*texts: str) -> int:
+    """Rough token count of prompt texts"""
+    return sum(len(text) for text in texts) // CHARS_PER_TOKEN + 1
+
+
+def _retry_after(error: RateLimitError) -> Optional[float]:
+    """Seconds to wait from 429 response headers"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+class TimedCache:
+    """Strings keyed by content hash, with TTL and least recently used eviction
+    
+    Writes are debounced: put only marks the cache dirty, and the whole file
+    is rewritten in a worker thread once per SAVE_DELAY. Subclasses define
+    make_key for their own inputs.
+    """
+    
+    # Seconds of puts collapsed into one rewrite of the cache file
+    SAVE_DELAY = 5.0
+    
+    def __init__(self, cache_file: str, max_entries: int, ttl_days: int):
+        self.cache_file = cache_file
+        self.max_entries = max_entries
+        self.ttl = timedelta(days=ttl_days)
+        self.entries: Dict[str, Dict[str, str]] = self._load()
+        self._dirty = False
+        self._save_task: Optional[asyncio.Task] = None
+        self._save_lock = asyncio.Lock()
+    
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        """Load cached values from disk, dropping expired ones"""
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+        
+        if not isinstance(data, dict):
+            return {}
+        
+        entries = {}
+        for key, entry in data.items():
+            # Files written before the common base stored the text as "caption"
+            if isinstance(entry, dict) and "caption" in entry:
+                entry.setdefault("value", entry.pop("caption"))
+            if not self._is_expired(entry):
+                entries[key] = entry
+        return entries
+    
+    def _write(self, payload: str) -> None:
+        """Replace cache file with serialized entries"""
+        try:
+            tmp_file = f"{self.cache_file}.tmp"
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(payload)
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logging.error(f"Error saving {type(self).__name__}: {e}")
+    
+    def save(self) -> None:
+        """Persist cached values to disk (blocks the caller)"""
+        self._dirty = False
+        self._write(json.dumps(self.entries, ensure_ascii=False))
+    
+    async def asave(self) -> None:
+        """Persist cached values without blocking the event loop"""
+        async with self._save_lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            payload = json.dumps(self.entries, ensure_ascii=False)
+            await asyncio.to_thread(self._write, payload)
+    
+    async def close(self) -> None:
+        """Write pending changes at shutdown"""
+        if self._save_task is not None and not self._save_task.done():
+            self._save_task.cancel()
+        await self.asave()
+    
+    def _schedule_save(self) -> None:
+        """Rewrite the file after the debounce window"""
+        self._dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop to defer to - write right away
+            self.save()
+            return
+        
+        if self._save_task is None or self._save_task.done():
+            self._save_task = loop.create_task(self._delayed_save())
+    
+    async def _delayed_save(self) -> None:
+        """Save once the debounce window has passed"""
+        await asyncio.sleep(self.SAVE_DELAY)
+        # Shielded: close cancels the wait, never a write in progress
+        await asyncio.shield(self.asave())
+    
+    def _is_expired(self, entry: Dict[str, str]) -> bool:
+        """Check if entry is older than TTL"""
+        try:
+            created = datetime.fromisoformat(entry["created"])
+        except (KeyError, TypeError, ValueError):
+            return True
+        return datetime.now(timezone.utc) - created > self.ttl
+    
+    def get(self, key: str) -> Optional[str]:
+        """Get cached value"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        
+        if self._is_expired(entry):
+            del self.entries[key]
+            return None
+        
+        # Recently used entries move to the end and are evicted last
+        self.entries[key] = self.entries.pop(key)
+        return entry["value"]
+    
+    def put(self, key: str, value: str) -> None:
+        """Store value, evicting least recently used entries over the limit"""
+        self.entries.pop(key, None)
+        self.entries[key] = {
+            "value": value,
+            "created": datetime.now(timezone.utc).isoformat()
+        }
+        
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+        
+        self._schedule_save()
+
+
+class CaptionCache(TimedCache):
+    """Generated captions keyed by hash of the prompt inputs"""
+    
+    @staticmethod
+    def make_key(title: str, context: str, category: str) -> str:
+        """Content hash of everything that shapes the caption"""
+        payload = json.dumps(
+            [CAPTION_PROMPT_VERSION, CAPTION_SYSTEM_PROMPT, title, context, category],
+            ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class DescriptionCache(TimedCache):
+    """Vision descriptions keyed by hash of the original image bytes"""
+    
+    @staticmethod
+    def make_key(image_bytes: bytes) -> str:
+        """Content hash of image and prompt"""
+        digest = hashlib.sha256(image_bytes)
+        digest.update(VISION_PROMPT.encode())
+        return digest.hexdigest()
+
+
+class ModelHealth:
+    """Live latency and error rate per model
+    
+    Stats are exponential moving averages; the error rate also decays with
+    time since the last call, so a demoted model is retried eventually.
+    """
+    
+    # Weight of the newest sample in moving averages
+    ALPHA = 0.3
+    
+    # Error rate halves every this many seconds without calls
+    ERROR_HALF_LIFE = 300.0
+    
+    def __init__(self, slow_threshold: float):
+        self.slow_threshold = slow_threshold
+        self.stats: Dict[str, Dict[str, float]] = {}
+    
+    def record(self, model: str, latency: float, ok: Optional[bool]) -> None:
+        """Record result of one call
+        
+        ok=None means the call was cancelled after losing a hedge race:
+        only the latency (a lower bound) is known.
+        """
+        entry = self.stats.get(model)
+        if entry is None:
+            self.stats[model] = {
+                "latency": latency,
+                "errors": 1.0 if ok is False else 0.0,
+                "updated": time.monotonic()
+            }
+            return
+        
+        if ok is not None:
+            entry["errors"] = self.error_rate(model) * (1 - self.ALPHA) + (0.0 if ok else self.ALPHA)
+        if ok is not False:
+            entry["latency"] = entry["latency"] * (1 - self.ALPHA) + latency * self.ALPHA
+        entry["updated"] = time.monotonic()
+    
+    def error_rate(self, model: str) -> float:
+        """Current error rate of model"""
+        entry = self.stats.get(model)
+        if entry is None:
+            return 0.0
+        elapsed = time.monotonic() - entry["updated"]
+        return entry["errors"] * 0.5 ** (elapsed / self.ERROR_HALF_LIFE)
+    
+    def _tier(self, model: str) -> int:
+        """0 - healthy, 1 - slow, 2 - failing"""
+        if self.error_rate(model) >= 0.5:
+            return 2
+        entry = self.stats.get(model)
+        if entry and self.slow_threshold > 0 and entry["latency"] > self.slow_threshold:
+            return 1
+        return 0
+    
+    def ordered(self, models: List[str]) -> List[str]:
+        """Models by health, configured order within the same tier"""
+        return sorted(models, key=lambda model: (self._tier(model), models.index(model)))
 
 
 class AIService:
@@ -16,6 +273,29 @@ class AIService:
     def __init__(self, config: BotConfig):
         self.config = config
         self.client = AsyncOpenAI(api_key=config.openai_api_key)
+        self.model_health = ModelHealth(config.ai_hedge_delay_seconds)
+        
+        # One queue per kind of call, each with its own limits
+        self.schedulers = {
+            "text": RequestScheduler("text", config.ai_text_rpm, config.ai_text_tpm),
+            "image": RequestScheduler("image", config.ai_image_rpm),
+            "vision": RequestScheduler("vision", config.ai_vision_rpm, config.ai_vision_tpm)
+        }
+        self.caption_cache = CaptionCache(
+            config.caption_cache_file,
+            config.caption_cache_max_entries,
+            config.caption_cache_ttl_days
+        )
+        self.vision_cache = DescriptionCache(
+            config.vision_cache_file,
+            config.vision_cache_max_entries,
+            config.caption_cache_ttl_days
+        )
+    
+    async def close(self) -> None:
+        """Write cached captions and descriptions still waiting to be saved"""
+        await self.caption_cache.close()
+        await self.vision_cache.close()
     
     async def generate_caption(
         self,
@@ -23,15 +303,33 @@ class AIService:
         context: str,
         category: str = "sneakers",
         is_thought: bool = False,
-        image_description: str = ""
+        image_description: str = "",
+        use_cache: bool = True,
+        background: bool = False
     ) -> str:
-        """Generate caption for post"""
+        """Generate caption for post
+        
+        Post captions are cached by content; pass use_cache=False to
+        regenerate and overwrite the cached caption. Background requests
+        yield to interactive ones in the request queue.
+        """
         if is_thought:
-            return await self._generate_thought(title, image_description)
+            return await self._generate_thought(title, image_description, background)
         else:
-            return await self._generate_post_caption(title, context, category)
+            return await self._generate_post_caption(title, context, category, use_cache, background)
+    
+    @staticmethod
+    def _caption_details(context: str) -> str:
+        """Context excerpt sent to the model"""
+        return context[:500] if context else 'Нет информации'
+    
+    def get_cached_caption(self, title: str, context: str, category: str = "sneakers") -> Optional[str]:
+        """Cached caption for post content, if any"""
+        return self.caption_cache.get(
+            CaptionCache.make_key(title, self._caption_details(context), category)
+        )
     
-    async def _generate_thought(self, topic: str, image_description: str = "") -> str:
+    async def _generate_thought(self, topic: str, image_description: str = "", background: bool = False) -> str:
         """Generate thought-style post"""
         system_prompt = THOUGHTS_SYSTEM_PROMPT
         
@@ -49,29 +347,54 @@ class AIService:
             user_prompt,
             temperature=0.9,
             max_tokens=300,
-            default_response=f"💭 {topic}\n\nИнтересная тема для размышлений!"
+            default_response=f"💭 {topic}\n\nИнтересная тема для размышлений!",
+            background=background
         )
     
-    async def _generate_post_caption(self, title: str, context: str, category: str) -> str:
+    async def _generate_post_caption(
+        self,
+        title: str,
+        context: str,
+        category: str,
+        use_cache: bool = True,
+        background: bool = False
+    ) -> str:
         """Generate regular post caption"""
+        details = self._caption_details(context)
+        cache_key = CaptionCache.make_key(title, details, category)
+        
+        if use_cache:
+            cached = self.caption_cache.get(cache_key)
+            if cached:
+                logging.info(f"Caption cache hit: {title[:50]}")
+                return cached
+        
         system_prompt = CAPTION_SYSTEM_PROMPT
         user_prompt = (
             f"Заголовок: {title}\n"
-            f"Детали: {context[:500] if context else 'Нет информации'}"
+            f"Детали: {details}"
         )
+        default_response = f"🔥 Новый релиз. Подробности скоро!"
         
         caption = await self._generate_with_fallback(
             system_prompt,
             user_prompt,
             temperature=0.8,
-            max_tokens=300,
-            default_response=f"🔥 Новый релиз. Подробности скоро!"
+            max_tokens=CAPTION_MAX_TOKENS,
+            default_response=default_response,
+            background=background
         )
         
+        generated = caption != default_response
+        
         # Add title if not present
         if title.lower() not in caption.lower():
             caption = f"<b>{title}</b>\n\n{caption}"
         
+        # Canned fallback is not cached so the next request retries the API
+        if generated:
+            self.caption_cache.put(cache_key, caption)
+        
         return caption
     
     async def _generate_with_fallback(
@@ -80,14 +403,77 @@ class AIService:
         user_prompt: str,
         temperature: float = 0.8,
         max_tokens: int = 300,
-        default_response: str = ""
+        default_response: str = "",
+        background: bool = False
     ) -> str:
-        """Generate text with model fallback"""
-        for model in OPENAI_MODELS:
-            try:
-                logging.info(f"Generating with model {model}")
+        """Generate text with model fallback
+        
+        Models are tried in order of live health. If the current model has
+        not answered after ai_hedge_delay_seconds, the next one is started in
+        parallel and the first non-empty answer wins; a failed model is
+        replaced by the next one immediately.
+        """
+        models = self.model_health.ordered(OPENAI_MODELS)
+        if models != OPENAI_MODELS:
+            logging.info(f"Model order by health: {', '.join(models)}")
+        
+        hedge_delay = self.config.ai_hedge_delay_seconds
+        running = set()
+        
+        def start_next() -> bool:
+            if not models:
+                return False
+            running.add(asyncio.create_task(
+                self._generate_with_model(
+                    models.pop(0), system_prompt, user_prompt, temperature, max_tokens, background
+                )
+            ))
+            return True
+        
+        start_next()
+        try:
+            while running:
+                done, running = await asyncio.wait(
+                    running,
+                    timeout=hedge_delay if hedge_delay > 0 and models else None,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                
+                if not done:
+                    logging.info("No answer yet, hedging with next model")
+                    start_next()
+                    continue
                 
-                response = await self.client.chat.completions.create(
+                for task in done:
+                    generated = task.result()
+                    if generated:
+                        return generated
+                    start_next()
+        finally:
+            for task in running:
+                task.cancel()
+        
+        logging.error("All models failed, using default response")
+        return default_response
+    
+    async def _generate_with_model(
+        self,
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        temperature: float,
+        max_tokens: int,
+        background: bool = False
+    ) -> Optional[str]:
+        """Single generation attempt, recorded in model health"""
+        started = None
+        
+        async def request():
+            # Latency is measured from the actual call, not from the queue
+            nonlocal started
+            started = time.monotonic()
+            return await asyncio.wait_for(
+                self.client.chat.completions.create(
                     model=model,
                     temperature=temperature,
                     max_tokens=max_tokens,
@@ -95,75 +481,149 @@ class AIService:
                         {"role": "system", "content": system_prompt},
                         {"role": "user", "content": user_prompt}
                     ],
-                )
-                
-                generated = response.choices[0].message.content.strip()
-                if generated:
-                    logging.info(f"Successfully generated with {model}")
-                    return generated
-                    
-            except Exception as e:
-                logging.error(f"Error with model {model}: {type(e).__name__}: {str(e)}")
-                continue
+                ),
+                timeout=self.config.ai_model_timeout_seconds
+            )
         
-        logging.error("All models failed, using default response")
-        return default_response
+        try:
+            logging.info(f"Generating with model {model}")
+            
+            response = await self._request(
+                "text",
+                estimate_tokens(system_prompt, user_prompt) + max_tokens,
+                request,
+                background
+            )
+            
+            generated = (response.choices[0].message.content or "").strip()
+            self.model_health.record(model, time.monotonic() - started, bool(generated))
+            if generated:
+                logging.info(f"Successfully generated with {model}")
+                return generated
+        
+        except asyncio.CancelledError:
+            if started is not None:
+                self.model_health.record(model, time.monotonic() - started, None)
+            raise
+        except asyncio.TimeoutError:
+            self.model_health.record(model, time.monotonic() - started, False)
+            logging.error(f"Model {model} timed out")
+        except Exception as e:
+            if started is not None:
+                self.model_health.record(model, time.monotonic() - started, False)
+            logging.error(f"Error with model {model}: {type(e).__name__}: {str(e)}")
+        
+        return None
+    
+    async def _request(
+        self,
+        kind: str,
+        tokens: int,
+        request: Callable[[], Awaitable[Any]],
+        background: bool = False
+    ) -> Any:
+        """Run API call through the rate limiter, retrying on 429"""
+        scheduler = self.schedulers[kind]
+        priority = PRIORITY_BACKGROUND if background else PRIORITY_INTERACTIVE
+        
+        for attempt in range(self.config.ai_max_retries + 1):
+            await scheduler.acquire(tokens, priority)
+            try:
+                return await request()
+            except RateLimitError as e:
+                if attempt >= self.config.ai_max_retries:
+                    raise
+                
+                delay = _retry_after(e) or 2 ** attempt
+                logging.warning(f"OpenAI rate limit on {kind} request, retrying in {delay:.1f}s")
+                
+                # The whole queue of this kind waits, not just this request
+                scheduler.pause(delay)
     
-    async def generate_image(self, prompt: str, style: str = "photographic") -> Optional[str]:
+    async def generate_image(
+        self,
+        prompt: str,
+        style: str = "photographic",
+        background: bool = False
+    ) -> Optional[str]:
         """Generate image using DALL-E 3"""
         try:
             logging.info(f"Generating image: {prompt[:50]}...")
             
-            response = await self.client.images.generate(
-                model="dall-e-3",
-                prompt=prompt,
-                size="1024x1024",
-                quality="standard",
-                n=1,
+            response = await self._request(
+                "image",
+                0,
+                lambda: self.client.images.generate(
+                    model="dall-e-3",
+                    prompt=prompt,
+                    size="1024x1024",
+                    quality="standard",
+                    n=1,
+                ),
+                background
             )
             
             image_url = response.data[0].url
             logging.info("Image generated successfully")
             return image_url
-            
+        
         except Exception as e:
             logging.error(f"Error generating image: {e}")
             return None
     
-    async def analyze_image(self, image_bytes: bytes) -> str:
-        """Analyze image using GPT-4 Vision"""
+    async def analyze_image(self, image_bytes: bytes, background: bool = False) -> str:
+        """Analyze image using GPT-4 Vision
+        
+        Descriptions are cached by image content; the image is downscaled
+        to the model's useful input size before upload.
+        """
+        cache_key = DescriptionCache.make_key(image_bytes)
+        cached = self.vision_cache.get(cache_key)
+        if cached:
+            logging.info("Vision cache hit")
+            return cached
+        
         try:
+            # The model tiles images at up to ~768px on the short side, more is wasted upload
+            image_bytes = await asyncio.to_thread(
+                preprocess_image, image_bytes, self.config.vision_max_side, "JPEG", 85
+            )
+            
             # Convert to base64
             base64_image = base64.b64encode(image_bytes).decode('utf-8')
             
-            response = await self.client.chat.completions.create(
-                model="gpt-4-vision-preview",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "Опиши что изображено на этой картинке. "
-                                    "Особое внимание удели деталям, цветам, стилю. "
-                                    "Если это кроссовки или одежда - опиши модель, бренд, особенности дизайна."
-                                )
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:image/jpeg;base64,{base64_image}"
+            response = await self._request(
+                "vision",
+                VISION_IMAGE_TOKENS + 300,
+                lambda: self.client.chat.completions.create(
+                    model="gpt-4-vision-preview",
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [
+                                {
+                                    "type": "text",
+                                    "text": VISION_PROMPT
+                                },
+                                {
+                                    "type": "image_url",
+                                    "image_url": {
+                                        "url": f"data:image/jpeg;base64,{base64_image}"
+                                    }
                                 }
-                            }
-                        ]
-                    }
-                ],
-                max_tokens=300
+                            ]
+                        }
+                    ],
+                    max_tokens=300
+                ),
+                background
             )
             
-            return response.choices[0].message.content.strip()
-            
+            description = (response.choices[0].message.content or "").strip()
+            if description:
+                self.vision_cache.put(cache_key, description)
+            return description
+        
         except Exception as e:
             logging.error(f"Error analyzing image: {e}")
             return ""
@@ -0,0 +1,91 @@
+"""
+Auto-publish slot planning
+"""
+import bisect
+from datetime import datetime, time as day_time, timedelta, timezone
+from typing import List, Optional, Sequence
+
+from ..services.state_manager import StateManager
+from ..utils.time_utils import get_user_timezone
+
+
+# Safety bound on slot adjustments; quiet hours and spacing settle in a few steps
+MAX_ADJUSTMENTS = 100
+
+
+def in_quiet_hours(local: datetime, quiet_hours: Optional[Sequence[int]]) -> bool:
+    """Check if local time falls into [start, end) hours, possibly over midnight"""
+    if not quiet_hours:
+        return False
+    start, end = quiet_hours
+    if start == end:
+        return False
+    if start < end:
+        return start <= local.hour < end
+    return local.hour >= start or local.hour < end
+
+
+def quiet_hours_end(local: datetime, end_hour: int, tz) -> datetime:
+    """First moment after quiet hours that contain local time, in UTC"""
+    day = local.date() if local.hour < end_hour else local.date() + timedelta(days=1)
+    naive = datetime.combine(day, day_time(end_hour))
+    # pytz zones need localize, datetime.timezone does not
+    end = tz.localize(naive) if hasattr(tz, "localize") else naive.replace(tzinfo=tz)
+    return end.astimezone(timezone.utc)
+
+
+class AutoPublishPlanner:
+    """Publish slots for the favorites queue
+    
+    Slots follow publish_interval from the last auto-publish, skip quiet
+    hours in the user's timezone and keep auto_publish_gap seconds away
+    from posts scheduled by hand.
+    """
+    
+    def __init__(self, state_manager: StateManager):
+        self.state_manager = state_manager
+    
+    def _fit(self, candidate: datetime, tz, quiet_hours, scheduled: List[float], gap: float) -> datetime:
+        """Move candidate forward until it is outside quiet hours and spaced from schedule"""
+        for _ in range(MAX_ADJUSTMENTS):
+            local = candidate.astimezone(tz)
+            if in_quiet_hours(local, quiet_hours):
+                candidate = quiet_hours_end(local, quiet_hours[1], tz)
+                continue
+            
+            moment = candidate.timestamp()
+            position = bisect.bisect_right(scheduled, moment - gap)
+            if gap > 0 and position < len(scheduled) and scheduled[position] < moment + gap:
+                candidate = datetime.fromtimestamp(scheduled[position] + gap, timezone.utc)
+                continue
+            
+            break
+        return candidate
+    
+    def upcoming_slots(self, count: int = 1, now: Optional[datetime] = None) -> List[datetime]:
+        """Next count publish slots in UTC"""
+        now = now or datetime.now(timezone.utc)
+        interval = timedelta(seconds=self.state_manager.get("publish_interval", 3600))
+        quiet_hours = self.state_manager.get("quiet_hours")
+        gap = self.state_manager.get("auto_publish_gap", 0)
+        tz = get_user_timezone(self.state_manager.state)
+        scheduled = self.state_manager.get_scheduled_times()
+        
+        candidate = now
+        last_publish = self.state_manager.get("last_auto_publish")
+        if last_publish:
+            last_time = datetime.fromisoformat(last_publish.replace('Z', '+00:00'))
+            if last_time.tzinfo is None:
+                last_time = last_time.replace(tzinfo=timezone.utc)
+            candidate = max(now, last_time + interval)
+        
+        slots = []
+        while len(slots) < count:
+            slot = self._fit(candidate, tz, quiet_hours, scheduled, gap)
+            slots.append(slot)
+            candidate = slot + interval
+        return slots
+    
+    def next_slot(self, now: Optional[datetime] = None) -> datetime:
+        """Next publish slot in UTC"""
+        return self.upcoming_slots(1, now)[0]
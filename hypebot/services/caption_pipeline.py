@@ -0,0 +1,77 @@
+"""
+Caption pre-generation for fetched posts
+"""
+import asyncio
+import logging
+from typing import List, Optional, Set
+
+from ..config.settings import BotConfig
+from ..models.post import Post
+from ..services.ai_service import AIService
+from ..services.state_manager import StateManager
+
+
+class CaptionPregenerator:
+    """Generate captions for new pending posts ahead of moderation
+    
+    Requests go to the AI service's shared text queue as background calls,
+    so they share its RPM/TPM limits and yield to interactive ones.
+    """
+    
+    def __init__(self, config: BotConfig, ai_service: AIService, state_manager: StateManager):
+        self.config = config
+        self.ai_service = ai_service
+        self.state_manager = state_manager
+        self._semaphore = asyncio.Semaphore(config.caption_pregen_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+    
+    def start(self, posts: List[Post]) -> None:
+        """Pre-generate captions in background, without holding up the caller"""
+        task = asyncio.get_running_loop().create_task(self.pregenerate(posts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def pregenerate(self, posts: Optional[List[Post]] = None) -> int:
+        """Fill Post.description for posts without caption
+        
+        Defaults to every pending post without a description. Returns the
+        number of captions stored.
+        """
+        if posts is None:
+            posts = self.state_manager.get_pending_posts()
+        posts = [post for post in posts if not post.description]
+        if not posts:
+            return 0
+        
+        results = await asyncio.gather(*(self._pregenerate_post(post) for post in posts))
+        stored = sum(results)
+        
+        logging.info(f"Pre-generated {stored} of {len(posts)} captions")
+        return stored
+    
+    async def _pregenerate_post(self, post: Post) -> bool:
+        """Generate and store caption for single post"""
+        async with self._semaphore:
+            try:
+                caption = self.ai_service.get_cached_caption(post.title, post.context, post.category)
+                if not caption:
+                    await self.ai_service.generate_caption(
+                        post.title, post.context, post.category, background=True
+                    )
+                    
+                    # Only real captions reach the cache, the canned fallback is skipped
+                    caption = self.ai_service.get_cached_caption(post.title, post.context, post.category)
+                    if not caption:
+                        return False
+            except Exception as e:
+                logging.error(f"Error pre-generating caption for {post.id}: {e}")
+                return False
+        
+        # Post may have been moderated or edited while waiting
+        current = self.state_manager.get_pending_post(post.id)
+        if not current or current.description:
+            return False
+        
+        current.description = caption
+        self.state_manager.add_pending_post(current)
+        return True
@@ -0,0 +1,407 @@
+"""
+Content fetching service
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+from urllib.parse import urljoin, urlparse
+from xml.etree.ElementTree import ParseError
+
+import httpx
+from bs4 import BeautifulSoup
+
+from ..config.settings import BotConfig
+from ..config.sources import SOURCES, DEFAULT_HEADERS, SNEAKER_KEYWORDS
+from ..models.post import Post
+from ..services.image_service import ImageService
+from ..services.state_manager import StateManager
+from ..services.story_clusterer import StoryClusterer
+from ..services.tag_extractor import TagExtractor
+from ..utils.rss_parser import StreamingFeedParser
+from ..utils.time_utils import parse_feed_date
+from ..utils.validators import is_valid_image_url
+
+
+# Items taken from each source per check
+MAX_ITEMS_PER_SOURCE = 10
+
+
+def make_post_id(source_key: str, link: str) -> str:
+    """Build stable post id from source key and link"""
+    return hashlib.md5(f"{source_key}|{link}".encode()).hexdigest()[:12]
+
+
+class FeedValidatorCache:
+    """Per-source conditional GET validators and newest seen item date"""
+    
+    def __init__(self, cache_file: str):
+        self.cache_file = cache_file
+        self.validators: Dict[str, Dict[str, str]] = self._load()
+    
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        """Load validators from disk"""
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def save(self) -> None:
+        """Persist validators to disk"""
+        try:
+            with open(self.cache_file, "w", encoding="utf-8") as f:
+                json.dump(self.validators, f, ensure_ascii=False)
+        except Exception as e:
+            logging.error(f"Error saving feed cache: {e}")
+    
+    def request_headers(self, source_key: str) -> Dict[str, str]:
+        """Conditional request headers for source"""
+        entry = self.validators.get(source_key, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+    
+    def update(self, source_key: str, response: httpx.Response) -> None:
+        """Remember validators from successful response"""
+        entry = self.validators.setdefault(source_key, {})
+        for header, key in (("etag", "etag"), ("last-modified", "last_modified")):
+            if response.headers.get(header):
+                entry[key] = response.headers[header]
+            else:
+                entry.pop(key, None)
+    
+    def get_newest(self, source_key: str) -> Optional[datetime]:
+        """Date of newest item already seen for source"""
+        newest = self.validators.get(source_key, {}).get("newest")
+        return datetime.fromisoformat(newest) if newest else None
+    
+    def set_newest(self, source_key: str, newest: datetime) -> None:
+        """Remember date of newest item seen for source"""
+        self.validators.setdefault(source_key, {})["newest"] = newest.isoformat()
+
+
+class ContentFetcher:
+    """Fetch new releases from all sources concurrently"""
+    
+    def __init__(
+        self,
+        config: BotConfig,
+        state_manager: StateManager,
+        image_service: Optional[ImageService] = None
+    ):
+        self.config = config
+        self.state_manager = state_manager
+        self.image_service = image_service
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore = asyncio.Semaphore(config.fetch_concurrency)
+        self.feed_cache = FeedValidatorCache(self._feed_cache_path(config))
+        self.clusterer = StoryClusterer(config, state_manager)
+    
+    @staticmethod
+    def _feed_cache_path(config: BotConfig) -> str:
+        """Keep feed cache next to state file"""
+        cache_path = Path(config.feed_cache_file)
+        if cache_path.is_absolute():
+            return str(cache_path)
+        return str(Path(config.state_file).parent / cache_path)
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared keep-alive HTTP client"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=DEFAULT_HEADERS,
+                timeout=httpx.Timeout(self.config.fetch_timeout_seconds),
+                limits=httpx.Limits(
+                    max_connections=self.config.fetch_concurrency * 2,
+                    max_keepalive_connections=self.config.fetch_concurrency
+                ),
+                follow_redirects=True
+            )
+        return self._client
+    
+    async def close(self) -> None:
+        """Close the shared HTTP client"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+    
+    async def fetch_all(self, sources: Optional[List[Dict[str, Any]]] = None) -> List[Post]:
+        """Fetch new posts from all sources at once
+        
+        Only fetches: the caller queues the posts and runs the later stages,
+        see bot.queue_fetched_posts.
+        """
+        sources = sources if sources is not None else SOURCES
+        
+        results = await asyncio.gather(
+            *(self._fetch_source(source) for source in sources)
+        )
+        self.feed_cache.save()
+        
+        posts = [post for source_posts in results for post in source_posts]
+        
+        # Newest first
+        posts.sort(key=lambda p: p.timestamp, reverse=True)
+        
+        # Same story from several feeds collapses into one post
+        posts = self.clusterer.cluster(posts)
+        
+        # Stories retitled by another feed still share press photos
+        if self.image_service is not None and posts:
+            posts = await self.image_service.merge_duplicates(posts)
+        
+        logging.info(f"Fetched {len(posts)} new posts from {len(sources)} sources")
+        return posts
+    
+    async def test_sources(self, sources: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        """Check connectivity of all sources at once"""
+        sources = sources if sources is not None else SOURCES
+        return await asyncio.gather(*(self._test_source(source) for source in sources))
+    
+    async def _test_source(self, source: Dict[str, Any]) -> Dict[str, Any]:
+        """Check single source connectivity"""
+        try:
+            response = await self._get(source)
+            return {"source": source, "status_code": response.status_code, "error": None}
+        except Exception as e:
+            return {"source": source, "status_code": None, "error": type(e).__name__}
+    
+    def _source_timeout(self, source: Dict[str, Any]) -> float:
+        """Total time budget for one source"""
+        return source.get("timeout", self.config.fetch_timeout_seconds)
+    
+    async def _get(self, source: Dict[str, Any]) -> httpx.Response:
+        """GET source url with concurrency cap and total per-source timeout"""
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                self.client.get(source["api"]),
+                self._source_timeout(source)
+            )
+    
+    async def _fetch_source(self, source: Dict[str, Any]) -> List[Post]:
+        """Fetch and parse single source"""
+        try:
+            logging.info(f"Checking source: {source['name']}")
+            async with self._semaphore:
+                return await asyncio.wait_for(
+                    self._fetch_and_parse(source),
+                    self._source_timeout(source)
+                )
+        
+        except (asyncio.TimeoutError, httpx.TimeoutException):
+            logging.error(f"Timeout fetching {source['name']}")
+        except httpx.HTTPError as e:
+            logging.error(f"HTTP error fetching {source['name']}: {e}")
+        except Exception as e:
+            logging.error(f"Unexpected error fetching {source['name']}: {e}")
+        
+        return []
+    
+    async def _fetch_and_parse(self, source: Dict[str, Any]) -> List[Post]:
+        """Stream source with conditional GET and parse it"""
+        headers = self.feed_cache.request_headers(source["key"])
+        
+        async with self.client.stream("GET", source["api"], headers=headers) as response:
+            if response.status_code == 304:
+                logging.info(f"Source not modified: {source['name']}")
+                return []
+            
+            response.raise_for_status()
+            
+            if source["type"] == "json":
+                await response.aread()
+                posts = self._parse_json_source(source, response.text)
+            else:
+                posts = await self._parse_rss_stream(source, response)
+            
+            # Validators are stored only after the payload was parsed
+            self.feed_cache.update(source["key"], response)
+            return posts
+    
+    def _is_known(self, post_id: str, link: str) -> bool:
+        """Check if post is already pending or sent"""
+        return self.state_manager.has_pending_post(post_id) or self.state_manager.is_link_sent(link)
+    
+    def _parse_json_source(self, source: Dict[str, Any], payload: str) -> List[Post]:
+        """Parse WordPress JSON API payload"""
+        try:
+            items = json.loads(payload)
+        except json.JSONDecodeError:
+            logging.error(f"Invalid JSON from {source['name']}")
+            return []
+        
+        if not isinstance(items, list):
+            logging.warning(f"Unexpected data format from {source['name']}")
+            return []
+        
+        posts = []
+        for item in items[:MAX_ITEMS_PER_SOURCE]:
+            try:
+                link = item.get("link")
+                title_data = item.get("title", {})
+                title = title_data.get("rendered", "") if isinstance(title_data, dict) else str(title_data)
+                title = BeautifulSoup(title, "html.parser").get_text(strip=True)
+                
+                if not link or not title or len(title) < 10:
+                    continue
+                
+                post_id = make_post_id(source["key"], link)
+                if self._is_known(post_id, link):
+                    continue
+                
+                date_str = item.get("date_gmt") or item.get("date") or item.get("modified")
+                if date_str:
+                    pub_date = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
+                    if pub_date.tzinfo is None:
+                        pub_date = pub_date.replace(tzinfo=timezone.utc)
+                else:
+                    pub_date = datetime.now(timezone.utc)
+                
+                images = []
+                media = item.get("_embedded", {}).get("wp:featuredmedia", [])
+                if media and isinstance(media, list):
+                    featured_url = media[0].get("source_url")
+                    if featured_url and is_valid_image_url(featured_url):
+                        images.append(featured_url)
+                
+                posts.append(self._build_post(source, post_id, title, link, pub_date, images, ""))
+            
+            except Exception as e:
+                logging.error(f"Error processing post from {source['name']}: {e}")
+        
+        return posts
+    
+    @staticmethod
+    async def _iter_feed_items(response: httpx.Response) -> AsyncIterator[Dict[str, str]]:
+        """Yield feed items while the body is still downloading"""
+        parser = StreamingFeedParser()
+        async for chunk in response.aiter_bytes():
+            for item in parser.feed(chunk):
+                yield item
+        for item in parser.close():
+            yield item
+    
+    async def _parse_rss_stream(self, source: Dict[str, Any], response: httpx.Response) -> List[Post]:
+        """Parse RSS/Atom feed incrementally
+        
+        Feeds are newest first, so reading stops at the first item that is
+        not newer than the newest one seen on a previous check.
+        """
+        newest_seen = self.feed_cache.get_newest(source["key"])
+        newest = newest_seen
+        
+        posts = []
+        items_read = 0
+        items = self._iter_feed_items(response)
+        try:
+            async for item in items:
+                pub_date = parse_feed_date(item.get("date", ""))
+                if pub_date and newest_seen and pub_date <= newest_seen:
+                    break
+                
+                if pub_date and (newest is None or pub_date > newest):
+                    newest = pub_date
+                
+                try:
+                    post = self._build_rss_post(source, item, pub_date)
+                    if post:
+                        posts.append(post)
+                except Exception as e:
+                    logging.error(f"Error processing RSS item from {source['name']}: {e}")
+                
+                items_read += 1
+                if items_read >= MAX_ITEMS_PER_SOURCE:
+                    break
+        
+        except ParseError as e:
+            logging.error(f"Malformed feed from {source['name']}: {e}")
+        finally:
+            await items.aclose()
+        
+        if newest and newest != newest_seen:
+            self.feed_cache.set_newest(source["key"], newest)
+        
+        return posts
+    
+    def _build_rss_post(
+        self,
+        source: Dict[str, Any],
+        item: Dict[str, str],
+        pub_date: Optional[datetime]
+    ) -> Optional[Post]:
+        """Create post from streamed feed item"""
+        link = item.get("link")
+        title = item.get("title")
+        
+        if not link or not title or len(title) < 10:
+            return None
+        
+        if not self._matches_category(source, title):
+            logging.debug(f"Skipping off-topic post: {title}")
+            return None
+        
+        post_id = make_post_id(source["key"], link)
+        if self._is_known(post_id, link):
+            return None
+        
+        images = []
+        context = ""
+        if item.get("description"):
+            desc_soup = BeautifulSoup(item["description"], "html.parser")
+            context = desc_soup.get_text(strip=True)[:500]
+            
+            first_img = desc_soup.find("img", src=True)
+            if first_img:
+                img_url = urljoin(f"https://{urlparse(link).netloc}", first_img["src"])
+                if is_valid_image_url(img_url):
+                    images.append(img_url)
+        
+        return self._build_post(
+            source,
+            post_id,
+            title,
+            link,
+            pub_date or datetime.now(timezone.utc),
+            images,
+            context
+        )
+    
+    @staticmethod
+    def _matches_category(source: Dict[str, Any], title: str) -> bool:
+        """Filter mixed feeds down to sneaker posts"""
+        if source.get("category") != "sneakers":
+            return True
+        title_lower = title.lower()
+        return any(keyword in title_lower for keyword in SNEAKER_KEYWORDS)
+    
+    @staticmethod
+    def _build_post(
+        source: Dict[str, Any],
+        post_id: str,
+        title: str,
+        link: str,
+        pub_date: datetime,
+        images: List[str],
+        context: str
+    ) -> Post:
+        """Create post from parsed feed item"""
+        return Post(
+            id=post_id,
+            title=title[:200],
+            link=link,
+            source=source["name"],
+            category=source.get("category", "sneakers"),
+            timestamp=pub_date.isoformat(),
+            context=context,
+            images=images,
+            tags=TagExtractor.extract_tags(title, context)
+        )
@@ -0,0 +1,548 @@
+"""
+Image service: local image cache, preprocessing and Telegram media sending
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+import httpx
+from telegram import Bot, InputMediaPhoto, Message
+from telegram.constants import ParseMode
+
+from ..config.settings import BotConfig
+from ..config.sources import DEFAULT_HEADERS
+from ..models.post import Post
+from ..services.state_manager import StateManager
+from ..services.story_clusterer import merge_sources
+from ..utils.formatters import truncate_html
+from ..utils.image_hash import BKTree, dhash
+from ..utils.image_processing import preprocess_image
+
+
+# Telegram limit for media captions
+MAX_CAPTION_LENGTH = 1024
+
+
+def _sniff_extension(data: bytes) -> str:
+    """Guess image file extension from content"""
+    if data.startswith(b"\x89PNG"):
+        return ".png"
+    if data.startswith(b"GIF8"):
+        return ".gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ".webp"
+    return ".jpg"
+
+
+class ImageCache:
+    """Content-addressed image files with LRU eviction by total size
+    
+    Files are named by sha256 of their content, so the same picture behind
+    different urls is stored once. The index keeps url -> hash and blobs in
+    least recently used first order.
+    
+    put runs in worker threads; the index is guarded by a lock, and file
+    writes happen outside it.
+    """
+    
+    INDEX_FILE = "index.json"
+    
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.urls: Dict[str, str] = {}
+        self.blobs: Dict[str, Dict[str, Union[int, str]]] = {}
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._load()
+    
+    def _load(self) -> None:
+        """Load index, dropping entries whose files are gone"""
+        try:
+            with open(self.cache_dir / self.INDEX_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        
+        self.blobs = {
+            digest: blob
+            for digest, blob in data.get("blobs", {}).items()
+            if (self.cache_dir / f"{digest}{blob['ext']}").exists()
+        }
+        self.urls = {
+            url: digest
+            for url, digest in data.get("urls", {}).items()
+            if digest in self.blobs
+        }
+    
+    def save(self) -> None:
+        """Persist index to disk"""
+        # Writers take turns, each one saving the index as it is by then
+        with self._save_lock:
+            with self._lock:
+                payload = json.dumps({"urls": self.urls, "blobs": self.blobs})
+            try:
+                self._write_file(self.cache_dir / self.INDEX_FILE, payload.encode())
+            except Exception as e:
+                logging.error(f"Error saving image cache index: {e}")
+    
+    @staticmethod
+    def _write_file(path: Path, data: bytes) -> None:
+        """Write file atomically, readers never see it half-written"""
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    
+    @property
+    def total_bytes(self) -> int:
+        """Size of all cached files"""
+        return sum(blob["size"] for blob in self.blobs.values())
+    
+    def _path(self, digest: str) -> Path:
+        """File path of blob"""
+        return self.cache_dir / f"{digest}{self.blobs[digest]['ext']}"
+    
+    def get_hash(self, url: str) -> Optional[str]:
+        """Content hash of cached url"""
+        with self._lock:
+            return self.urls.get(url)
+    
+    def get_path(self, url: str) -> Optional[Path]:
+        """Local file of cached url, marking it recently used"""
+        with self._lock:
+            digest = self.urls.get(url)
+            if digest is None:
+                return None
+            
+            self.blobs[digest] = self.blobs.pop(digest)
+            return self._path(digest)
+    
+    def put(self, url: str, data: bytes) -> str:
+        """Store downloaded image, returns content hash
+        
+        Blocking: writes the file and the index, call from a worker thread.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        ext = _sniff_extension(data)
+        path = self.cache_dir / f"{digest}{ext}"
+        
+        with self._lock:
+            known = digest in self.blobs
+        if not known:
+            self._write_file(path, data)
+        
+        with self._lock:
+            if digest in self.blobs:
+                self.blobs[digest] = self.blobs.pop(digest)
+            else:
+                # Evicted by another worker since the write above
+                if not path.exists():
+                    self._write_file(path, data)
+                self.blobs[digest] = {"size": len(data), "ext": ext}
+            self.urls[url] = digest
+            self._evict()
+        
+        self.save()
+        return digest
+    
+    def _evict(self) -> None:
+        """Remove least recently used files over the size limit (lock held)"""
+        total = self.total_bytes
+        while total > self.max_bytes and len(self.blobs) > 1:
+            digest = next(iter(self.blobs))
+            self._path(digest).unlink(missing_ok=True)
+            total -= self.blobs.pop(digest)["size"]
+            self.urls = {url: value for url, value in self.urls.items() if value != digest}
+
+
+def _closest(tree: BKTree, hashes: List[int], max_distance: int, exclude: str = "") -> Optional[Tuple[str, int]]:
+    """Closest post in tree sharing a near-identical image"""
+    best = None
+    for value in hashes:
+        for distance, post_id in tree.search(value, max_distance):
+            if post_id == exclude:
+                continue
+            if best is None or distance < best[1]:
+                best = (post_id, distance)
+            break
+    return best
+
+
+class PerceptualIndex:
+    """Perceptual hashes of lead images of recent posts
+    
+    Hashes live in a BK-tree for near-neighbour lookups; posts older than
+    max_age_days are pruned and the tree rebuilt. Changes stay in memory
+    until save or asave.
+    """
+    
+    def __init__(self, index_file: str, max_age_days: int):
+        self.index_file = index_file
+        self.max_age = timedelta(days=max_age_days)
+        self.posts: Dict[str, Dict[str, Union[List[int], str]]] = self._load()
+        self.tree = BKTree()
+        if self.prune():
+            self.save()
+        self._rebuild()
+    
+    def _load(self) -> Dict[str, Dict[str, Union[List[int], str]]]:
+        """Load hashes from disk"""
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def _write(self, payload: str) -> None:
+        """Replace index file with serialized hashes"""
+        try:
+            with open(self.index_file, "w", encoding="utf-8") as f:
+                f.write(payload)
+        except Exception as e:
+            logging.error(f"Error saving image hash index: {e}")
+    
+    def save(self) -> None:
+        """Persist hashes to disk"""
+        self._write(json.dumps(self.posts))
+    
+    async def asave(self) -> None:
+        """Persist hashes without blocking the event loop"""
+        await asyncio.to_thread(self._write, json.dumps(self.posts))
+    
+    def _rebuild(self) -> None:
+        """Build BK-tree from stored hashes"""
+        self.tree = BKTree()
+        for post_id, entry in self.posts.items():
+            for value in entry["hashes"]:
+                self.tree.add(value, post_id)
+    
+    def prune(self) -> bool:
+        """Drop posts older than max age, returns whether any were dropped"""
+        cutoff = (datetime.now(timezone.utc) - self.max_age).isoformat()
+        expired = [post_id for post_id, entry in self.posts.items() if entry["time"] < cutoff]
+        if not expired:
+            return False
+        
+        for post_id in expired:
+            del self.posts[post_id]
+        self._rebuild()
+        return True
+    
+    def find(self, hashes: List[int], max_distance: int, exclude: str = "") -> Optional[Tuple[str, int]]:
+        """Closest known post sharing a near-identical image"""
+        return _closest(self.tree, hashes, max_distance, exclude)
+    
+    def add(self, post_id: str, hashes: List[int]) -> bool:
+        """Remember hashes of post, returns whether the index changed"""
+        if not hashes or post_id in self.posts:
+            return False
+        
+        self.posts[post_id] = {
+            "hashes": hashes,
+            "time": datetime.now(timezone.utc).isoformat()
+        }
+        for value in hashes:
+            self.tree.add(value, post_id)
+        return True
+
+
+class ImageService:
+    """Download, cache and send post images"""
+    
+    def __init__(self, config: BotConfig, state_manager: StateManager):
+        self.config = config
+        self.state_manager = state_manager
+        self.cache = ImageCache(config.image_cache_dir, config.image_cache_max_bytes)
+        self.phash_index = PerceptualIndex(
+            str(Path(config.image_cache_dir) / "phash.json"),
+            config.image_dedup_days
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Hashes of fetched posts, indexed once the posts are queued
+        self._fetched_hashes: Dict[str, List[int]] = {}
+        
+        # Pillow releases the GIL while decoding, resizing and encoding
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.image_workers,
+            thread_name_prefix="image"
+        )
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared keep-alive HTTP client"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=DEFAULT_HEADERS,
+                timeout=httpx.Timeout(self.config.image_download_timeout_seconds),
+                follow_redirects=True
+            )
+        return self._client
+    
+    async def close(self) -> None:
+        """Close the shared HTTP client and worker threads"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+        self._executor.shutdown(wait=False)
+    
+    async def download(self, url: str) -> Optional[str]:
+        """Download and preprocess image into cache once, returns content hash"""
+        digest = self.cache.get_hash(url)
+        if digest:
+            return digest
+        
+        try:
+            response = await self.client.get(url)
+            response.raise_for_status()
+        except Exception as e:
+            logging.error(f"Error downloading image {url}: {e}")
+            return None
+        
+        data = await asyncio.get_running_loop().run_in_executor(
+            self._executor,
+            preprocess_image,
+            response.content,
+            self.config.image_max_side,
+            self.config.image_format,
+            self.config.image_quality
+        )
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self.cache.put, url, data)
+    
+    async def prefetch(self, urls: List[str]) -> None:
+        """Download images in parallel, e.g. short-lived DALL-E urls right away"""
+        await asyncio.gather(*(self.download(url) for url in urls))
+    
+    async def _image_hash(self, url: str) -> Optional[int]:
+        """Perceptual hash of cached image"""
+        if not await self.download(url):
+            return None
+        
+        path = self.cache.get_path(url)
+        if path is None:
+            return None
+        
+        data = await asyncio.to_thread(path.read_bytes)
+        return await asyncio.get_running_loop().run_in_executor(self._executor, dhash, data)
+    
+    async def get_image_hashes(self, post: Post) -> List[int]:
+        """Perceptual hashes of post lead images"""
+        urls = post.images[:self.config.image_dedup_lead_images]
+        hashes = await asyncio.gather(*(self._image_hash(url) for url in urls))
+        return [value for value in hashes if value is not None]
+    
+    async def merge_duplicates(self, posts: List[Post]) -> List[Post]:
+        """Merge posts whose lead images match a queued or earlier fetched story
+        
+        Run on freshly fetched posts before they enter the queue. The first
+        post of a story wins, later copies from other sources go into its
+        duplicates and their links are marked as seen so they are not
+        fetched again. Copies of a story that already left the queue are
+        dropped. Returns the posts that are still new.
+        
+        The index learns the hashes only in index_images, once the posts
+        are queued.
+        """
+        if self.phash_index.prune():
+            await self.phash_index.asave()
+        all_hashes = await asyncio.gather(*(self.get_image_hashes(post) for post in posts))
+        max_distance = self.config.image_dedup_max_distance
+        
+        # Earlier posts of this batch, not yet in the index
+        batch_tree = BKTree()
+        targets: Dict[str, Post] = {}
+        changed: Dict[str, Post] = {}
+        self._fetched_hashes = {}
+        
+        unique = []
+        for post, hashes in zip(posts, all_hashes):
+            matches = [
+                match for match in (
+                    self.phash_index.find(hashes, max_distance, exclude=post.id),
+                    _closest(batch_tree, hashes, max_distance, exclude=post.id)
+                )
+                if match
+            ]
+            if matches:
+                post_id, distance = min(matches, key=lambda match: match[1])
+                self.state_manager.add_sent_link(post.link)
+                
+                target = targets.get(post_id) or self.state_manager.get_pending_post(post_id)
+                if target is None:
+                    logging.info(
+                        f"Skipping near-duplicate story {post.title[:50]} "
+                        f"(same images as {post_id}, distance {distance}, already out of the queue)"
+                    )
+                    continue
+                
+                logging.info(
+                    f"Merging near-duplicate story {post.title[:50]} "
+                    f"into {target.title[:50]} (same images, distance {distance})"
+                )
+                merge_sources(target, post)
+                targets[post_id] = target
+                if post_id not in self._fetched_hashes:
+                    changed[post_id] = target
+                continue
+            
+            self._fetched_hashes[post.id] = hashes
+            for value in hashes:
+                batch_tree.add(value, post.id)
+            targets[post.id] = post
+            unique.append(post)
+        
+        for target in changed.values():
+            self.state_manager.add_pending_post(target)
+        
+        return unique
+    
+    async def index_images(self, posts: List[Post]) -> None:
+        """Remember lead image hashes of queued posts for later duplicate checks
+        
+        Takes the hashes computed by merge_duplicates; posts of that batch
+        which did not reach the queue are forgotten. The index is saved
+        once, off the event loop.
+        """
+        fetched, self._fetched_hashes = self._fetched_hashes, {}
+        
+        added = False
+        for post in posts:
+            if post.id in fetched:
+                added = self.phash_index.add(post.id, fetched[post.id]) or added
+        
+        if added:
+            await self.phash_index.asave()
+    
+    def get_media_urls(self, post: Post, generated_images: List[str]) -> List[str]:
+        """Images of post in send order: generated covers first"""
+        urls = list(dict.fromkeys(generated_images + post.images))
+        return urls[:self.config.max_images_per_post]
+    
+    async def _media_source(self, url: str) -> Tuple[List[str], Union[str, bytes]]:
+        """What to hand Telegram for url: file_id, local file or the url itself
+        
+        Also returns registry keys to store the resulting file_id under,
+        empty when a known file_id is reused.
+        """
+        # Already sent once - no download, no upload
+        file_id = self.state_manager.get_file_id(url)
+        if file_id:
+            return [], file_id
+        
+        digest = await self.download(url)
+        if digest is None:
+            return [url], url
+        
+        # Same picture sent before under another url
+        file_id = self.state_manager.get_file_id(digest)
+        if file_id:
+            self.state_manager.set_file_id(url, file_id)
+            return [], file_id
+        
+        path = self.cache.get_path(url)
+        if path is None:
+            # Evicted again by concurrent downloads
+            return [url], url
+        return [url, digest], await asyncio.to_thread(path.read_bytes)
+    
+    async def build_media_group(
+        self,
+        post: Post,
+        generated_images: List[str],
+        for_channel: bool = True
+    ) -> Tuple[List[List[str]], List[InputMediaPhoto]]:
+        """Build media group, returns registry keys and media items"""
+        urls = self.get_media_urls(post, generated_images)
+        sources = await asyncio.gather(*(self._media_source(url) for url in urls))
+        
+        media = []
+        for index, (_, source) in enumerate(sources):
+            if index == 0 and for_channel:
+                media.append(InputMediaPhoto(
+                    source,
+                    caption=truncate_html(post.format_for_channel(), MAX_CAPTION_LENGTH),
+                    parse_mode=ParseMode.HTML
+                ))
+            else:
+                media.append(InputMediaPhoto(source))
+        
+        return [keys for keys, _ in sources], media
+    
+    async def send_media_group(
+        self,
+        bot: Bot,
+        chat_id: Union[int, str],
+        post: Post,
+        generated_images: List[str],
+        for_channel: bool = True
+    ) -> Optional[List[Message]]:
+        """Send post images as media group, None if post has no images"""
+        keys, media = await self.build_media_group(post, generated_images, for_channel)
+        if not media:
+            return None
+        return await self.send_built_media(bot, chat_id, keys, media)
+    
+    async def send_built_media(
+        self,
+        bot: Bot,
+        chat_id: Union[int, str],
+        keys: List[List[str]],
+        media: List[InputMediaPhoto]
+    ) -> List[Message]:
+        """Send media built by build_media_group and remember uploaded file_ids"""
+        if len(media) == 1:
+            # Media groups need at least two items
+            messages = [await bot.send_photo(
+                chat_id,
+                media[0].media,
+                caption=media[0].caption,
+                parse_mode=media[0].parse_mode
+            )]
+        else:
+            messages = await bot.send_media_group(chat_id, media)
+        self.remember_file_ids(keys, messages)
+        return messages
+    
+    async def send_photo(
+        self,
+        bot: Bot,
+        chat_id: Union[int, str],
+        url: str,
+        caption: str
+    ) -> Message:
+        """Send single photo with caption"""
+        keys, source = await self._media_source(url)
+        message = await bot.send_photo(
+            chat_id,
+            source,
+            caption=truncate_html(caption, MAX_CAPTION_LENGTH),
+            parse_mode=ParseMode.HTML
+        )
+        self.remember_file_ids([keys], [message])
+        return message
+    
+    @staticmethod
+    def reuse_uploaded(media: List[InputMediaPhoto], messages: List[Message]) -> List[InputMediaPhoto]:
+        """Same media group pointing at file_ids of sent messages, for sending again without upload"""
+        reused = []
+        for item, message in zip(media, messages):
+            source = message.photo[-1].file_id if message.photo else item.media
+            reused.append(InputMediaPhoto(source, caption=item.caption, parse_mode=item.parse_mode))
+        return reused
+    
+    def remember_file_ids(self, keys: List[List[str]], messages: List[Message]) -> None:
+        """Register file_id of uploaded images by url and hash for later sends"""
+        for image_keys, message in zip(keys, messages):
+            if not message.photo:
+                continue
+            for key in image_keys:
+                self.state_manager.set_file_id(key, message.photo[-1].file_id)
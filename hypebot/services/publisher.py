@@ -1,18 +1,114 @@
 """
 Publishing service
 """
+import asyncio
 import logging
-from datetime import datetime, timezone
-from typing import Optional, List
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, List, Set, Union
 
-from telegram import Bot, InputMediaPhoto
+from telegram import Bot, InputMediaPhoto, Message
 from telegram.constants import ParseMode
-from telegram.error import TelegramError
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 
 from ..models.post import Post, ThoughtPost
 from ..models.schedule import ScheduledPost
-from ..services.state_manager import StateManager
+from ..services.state_manager import StateManager, TAG_FIELDS
+from ..services.auto_publish import AutoPublishPlanner
 from ..services.image_service import ImageService
+from ..services.rate_limiter import SendThrottler
+
+
+# Telegram Bot API limits: overall, per channel/group, per private chat
+TELEGRAM_MESSAGES_PER_SECOND = 30
+TELEGRAM_GROUP_MESSAGES_PER_MINUTE = 20
+TELEGRAM_PRIVATE_MESSAGES_PER_MINUTE = 60
+TELEGRAM_CHAT_BURST = 3
+
+# Send priorities, lower goes first
+PRIORITY_CHANNEL = 0
+PRIORITY_ADMIN = 1
+
+# Sends retried after RetryAfter before the error is raised
+SEND_MAX_RETRIES = 2
+
+# Retry delay for a scheduled post whose publication failed
+SCHEDULE_RETRY_SECONDS = 60
+
+# Outbox job states: queued -> sending -> sent / failed
+JOB_QUEUED = "queued"
+JOB_SENDING = "sending"
+JOB_SENT = "sent"
+JOB_FAILED = "failed"
+
+# Outbox retries: exponential backoff from base delay, capped
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_BASE_DELAY_SECONDS = 5
+OUTBOX_MAX_DELAY_SECONDS = 900
+
+# Finished jobs are kept this long so repeated publishes stay no-ops
+OUTBOX_RETENTION_DAYS = 7
+
+
+def outbox_key(post_id: str, channel: str) -> str:
+    """Idempotency key of publishing post to channel"""
+    return f"{post_id}@{channel}"
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Flood wait of RetryAfter, int or timedelta depending on library version"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+@dataclass
+class RenderedPost:
+    """Caption and media group of a post, built once for all channels"""
+    text: str
+    keys: List[List[str]] = field(default_factory=list)
+    media: List[InputMediaPhoto] = field(default_factory=list)
+    # Set once the images are uploaded, later sends reuse their file_ids
+    uploaded: bool = False
+
+
+class ThrottledBot:
+    """Bot wrapper passing every send through the shared throttler
+    
+    A media group costs one message per item. RetryAfter pauses all sends
+    for the flood delay and the send is retried.
+    """
+    
+    def __init__(self, bot: Bot, throttler: SendThrottler, priority: int):
+        self._bot = bot
+        self._throttler = throttler
+        self._priority = priority
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._bot, name)
+    
+    async def _send(self, method: str, chat_id: Union[int, str], weight: int, *args: Any, **kwargs: Any) -> Any:
+        """Call bot method once throttler allows it"""
+        for attempt in range(SEND_MAX_RETRIES + 1):
+            await self._throttler.acquire(chat_id, weight, self._priority)
+            try:
+                return await getattr(self._bot, method)(chat_id, *args, **kwargs)
+            except RetryAfter as e:
+                if attempt == SEND_MAX_RETRIES:
+                    raise
+                delay = retry_after_seconds(e)
+                logging.warning(f"Telegram flood control, pausing sends for {delay:.0f}s")
+                self._throttler.pause(delay)
+    
+    async def send_message(self, chat_id: Union[int, str], *args: Any, **kwargs: Any) -> Message:
+        return await self._send("send_message", chat_id, 1, *args, **kwargs)
+    
+    async def send_photo(self, chat_id: Union[int, str], *args: Any, **kwargs: Any) -> Message:
+        return await self._send("send_photo", chat_id, 1, *args, **kwargs)
+    
+    async def send_media_group(self, chat_id: Union[int, str], media: List[Any], *args: Any, **kwargs: Any) -> List[Message]:
+        return await self._send("send_media_group", chat_id, len(media), media, *args, **kwargs)
 
 
 class PublisherService:
@@ -27,48 +123,369 @@ class PublisherService:
         self.bot = bot
         self.state_manager = state_manager
         self.image_service = image_service
+        
+        # All sends share one throttler; channel posts go before admin messages
+        throttler = SendThrottler(
+            TELEGRAM_MESSAGES_PER_SECOND,
+            TELEGRAM_GROUP_MESSAGES_PER_MINUTE,
+            TELEGRAM_PRIVATE_MESSAGES_PER_MINUTE,
+            TELEGRAM_CHAT_BURST
+        )
+        self.channel_bot = ThrottledBot(bot, throttler, PRIORITY_CHANNEL)
+        self.admin_bot = ThrottledBot(bot, throttler, PRIORITY_ADMIN)
+        
+        self.planner = AutoPublishPlanner(state_manager)
+        
+        # Outbox jobs being sent right now and wake-up signal of the worker
+        self._inflight: Set[str] = set()
+        self._outbox_changed = asyncio.Event()
+        
+        # Background loops started by start()
+        self._tasks: List[asyncio.Task] = []
+        
+        # Failed auto-publish attempts in a row, the slot is retried with backoff
+        self._auto_failures = 0
+    
+    async def start(self) -> None:
+        """Recover the outbox and start the background publishing loops
+        
+        Called once from the application's startup hook. Jobs left "sending"
+        by the previous process are classified before run_outbox or
+        publish_post can pick them up.
+        """
+        await self._recover_outbox()
+        
+        loop = asyncio.get_running_loop()
+        self._tasks = [
+            loop.create_task(self.run_outbox()),
+            loop.create_task(self.run_scheduler()),
+            loop.create_task(self.run_auto_publish())
+        ]
+    
+    async def stop(self) -> None:
+        """Stop the background publishing loops"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
     
-    async def publish_post(self, post: Post, channel: Optional[str] = None) -> bool:
-        """Publish post to channel"""
+    async def publish_post(self, post: Post, channel: Optional[str] = None, notice: Optional[str] = None) -> bool:
+        """Publish post to channel through the outbox
+        
+        Without a channel the post goes to the main channel and every
+        channel whose rule matches it (see publish_fanout); the result is
+        the main channel's.
+        
+        The first attempt is made right away. Returns True once the post is
+        sent or queued for retry by run_outbox, False if it failed for good.
+        Publishing the same post to the same channel again is a no-op, and
+        a job waiting for its retry is left to run_outbox. The admin gets
+        notice once the post is actually delivered.
+        """
         if not channel:
-            channel = self.state_manager.state.channel
+            channels = self.get_fanout_channels(post)
+            if not channels:
+                logging.error(f"No channel to publish to: {post.title[:50]}")
+                return False
+            
+            results = await self.publish_fanout(post, channels, notice)
+            return results[channels[0]]
+        
+        job = self._enqueue(post, channel, notice)
+        if job["state"] == JOB_SENT:
+            logging.info(f"Already published, skipping: {post.title[:50]}")
+            self._finish_sent(post)
+            return True
+        if job["id"] in self._inflight:
+            return True
+        if job["state"] == JOB_QUEUED and not self._is_due(job):
+            logging.info(f"Already queued for retry at {job['next_attempt']}: {post.title[:50]}")
+            return True
+        
+        await self._process_job(job["id"])
+        return self.state_manager.get_outbox_job(job["id"])["state"] != JOB_FAILED
+    
+    async def _render(self, post: Post) -> RenderedPost:
+        """Format post and build its media group"""
+        # Get generated images if any
+        generated_images = self.state_manager.get_generated_images(post.id)
+        
+        # Media group from local cache / known file_ids
+        keys, media = await self.image_service.build_media_group(
+            post,
+            generated_images,
+            for_channel=True
+        )
+        return RenderedPost(text=post.format_for_channel(), keys=keys, media=media)
+    
+    async def _send_post(self, post: Post, channel: str, rendered: Optional[RenderedPost] = None) -> List[int]:
+        """Send post to channel, returns ids of sent messages, raises on failure"""
+        if rendered is None:
+            rendered = await self._render(post)
+        
+        if not rendered.media:
+            # Text-only post
+            message = await self.channel_bot.send_message(
+                channel,
+                rendered.text,
+                parse_mode=ParseMode.HTML
+            )
+            return [message.message_id]
+        
+        messages = await self.image_service.send_built_media(
+            self.channel_bot,
+            channel,
+            rendered.keys,
+            rendered.media
+        )
+        if not rendered.uploaded:
+            rendered.media = self.image_service.reuse_uploaded(rendered.media, messages)
+            rendered.uploaded = True
+        return [message.message_id for message in messages]
+    
+    # Fan-out
+    def get_fanout_channels(self, post: Post) -> List[str]:
+        """Main channel plus channels whose rule matches the post
         
-        logging.info(f"Publishing to channel: {post.title[:50]}...")
+        Rules live in state "channel_rules" as
+        {"channel": "@name", "categories": [...], "tags": [["brand", "nike"], ...]};
+        a rule matches by category or by any tag, a rule without both matches all.
+        """
+        channels = [self.state_manager.get("channel")]
+        tags = post.tags.to_dict() if post.tags else {}
         
+        for rule in self.state_manager.get("channel_rules") or []:
+            categories = rule.get("categories") or []
+            rule_tags = rule.get("tags") or []
+            matches = (
+                (not categories and not rule_tags)
+                or post.category in categories
+                or any(
+                    tag in tags.get(TAG_FIELDS.get(tag_type, ""), [])
+                    for tag_type, tag in rule_tags
+                )
+            )
+            if matches and rule.get("channel") not in channels:
+                channels.append(rule["channel"])
+        
+        return [channel for channel in channels if channel]
+    
+    async def publish_fanout(
+        self,
+        post: Post,
+        channels: Optional[List[str]] = None,
+        notice: Optional[str] = None
+    ) -> Dict[str, bool]:
+        """Publish post to several channels at once
+        
+        Caption and media group are built once. Channels are tried one by
+        one until the images are uploaded; the rest reuse their file_ids and
+        are sent concurrently. Every channel is its own outbox job with its
+        own result and retries. The admin notice goes with the first channel.
+        """
+        if channels is None:
+            channels = self.get_fanout_channels(post)
+        
+        jobs = [
+            self._enqueue(post, channel, notice if index == 0 else None)
+            for index, channel in enumerate(channels)
+        ]
+        if any(job["state"] == JOB_SENT for job in jobs):
+            self._finish_sent(post)
+        
+        todo = [
+            job["id"] for job in jobs
+            if job["id"] not in self._inflight
+            and (job["state"] == JOB_SENDING or (job["state"] == JOB_QUEUED and self._is_due(job)))
+        ]
+        
+        if todo:
+            rendered = await self._render(post)
+            
+            # Nothing is sent concurrently until one upload has succeeded:
+            # the channels after it get file_ids instead of uploading again
+            while todo and rendered.media and not rendered.uploaded:
+                await self._process_job(todo.pop(0), rendered)
+            await asyncio.gather(*(self._process_job(job_id, rendered) for job_id in todo))
+        
+        results = {}
+        for job in jobs:
+            state = self.state_manager.get_outbox_job(job["id"])["state"]
+            results[job["channel"]] = state != JOB_FAILED
+            if state != JOB_SENT:
+                logging.warning(f"Fan-out to {job['channel']} not delivered yet ({state}): {post.title[:50]}")
+        return results
+    
+    # Outbox
+    def _enqueue(self, post: Post, channel: str, notice: Optional[str] = None) -> Dict[str, Any]:
+        """Create outbox job or return the existing one for post and channel"""
+        job_id = outbox_key(post.id, channel)
+        job = self.state_manager.get_outbox_job(job_id)
+        now = datetime.now(timezone.utc).isoformat()
+        
+        if job and job["state"] != JOB_FAILED:
+            return job
+        
+        # New job, or explicit re-publish of a failed one
+        job = {
+            "id": job_id,
+            "post_id": post.id,
+            "channel": channel,
+            "record": post.to_dict(),
+            "state": JOB_QUEUED,
+            "attempts": 0,
+            "next_attempt": now,
+            "created": now,
+            "updated": now,
+            "error": None,
+            "message_ids": [],
+            # Admin message sent on delivery
+            "notice": notice
+        }
+        self.state_manager.save_outbox_job(job)
+        return job
+    
+    def _set_job_state(self, job: Dict[str, Any], state: str, **fields: Any) -> None:
+        """Move job to state, written with the next flush"""
+        job.update(fields, state=state, updated=datetime.now(timezone.utc).isoformat())
+        self.state_manager.save_outbox_job(job)
+    
+    async def _update_job(self, job: Dict[str, Any], state: str, **fields: Any) -> None:
+        """Move job to state and persist it before going on"""
+        self._set_job_state(job, state, **fields)
+        await self.state_manager.aflush()
+    
+    async def _process_job(self, job_id: str, rendered: Optional[RenderedPost] = None) -> None:
+        """Make one delivery attempt of outbox job"""
+        job = self.state_manager.get_outbox_job(job_id)
+        if not job or job["state"] not in (JOB_QUEUED, JOB_SENDING) or job_id in self._inflight:
+            return
+        
+        self._inflight.add(job_id)
         try:
-            # Get generated images if any
-            generated_images = self.state_manager.state.generated_images.get(post.id, [])
+            post = Post.from_dict(job["record"])
+            logging.info(f"Publishing to {job['channel']} (attempt {job['attempts'] + 1}): {post.title[:50]}...")
             
-            # Build media group
-            media = self.image_service.build_media_group(
-                post,
-                generated_images,
-                for_channel=True
-            )
+            # "sending" hits the disk before the request, so a restart knows it was in flight
+            await self._update_job(job, JOB_SENDING, attempts=job["attempts"] + 1)
             
-            if media:
-                await self.bot.send_media_group(channel, media)
+            delay: Optional[float] = None
+            try:
+                message_ids = await self._send_post(post, job["channel"], rendered)
+            except RetryAfter as e:
+                delay = retry_after_seconds(e)
+                error = f"Flood control, retry in {delay:.0f}s"
+            except (BadRequest, Forbidden) as e:
+                # Permanent: the same request will fail again
+                error = str(e)
+            except TelegramError as e:
+                delay = self._backoff(job["attempts"])
+                error = str(e)
+            except Exception as e:
+                delay = self._backoff(job["attempts"])
+                error = f"Unexpected error: {e}"
             else:
-                # Text-only post
-                text = post.format_for_channel()
-                await self.bot.send_message(
-                    channel,
-                    text,
-                    parse_mode=ParseMode.HTML
-                )
+                # Delivery is recorded on the job itself first: the post-level
+                # sent link is set by the first of several fan-out channels
+                await self._update_job(job, JOB_SENT, error=None, message_ids=message_ids)
+                self._finish_sent(post)
+                logging.info(f"Successfully published: {post.title[:50]}")
+                if job.get("notice"):
+                    await self._notify_admin(job["notice"])
+                return
+            
+            if delay is not None and job["attempts"] < OUTBOX_MAX_ATTEMPTS:
+                next_attempt = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                await self._update_job(job, JOB_QUEUED, error=error, next_attempt=next_attempt.isoformat())
+                logging.warning(f"Publishing failed ({error}), retry in {delay:.0f}s: {post.title[:50]}")
+                self._outbox_changed.set()
+                return
             
-            # Mark as sent
+            await self._update_job(job, JOB_FAILED, error=error)
+            logging.error(f"Publishing failed permanently ({error}): {post.title[:50]}")
+            await self._notify_admin(f"❌ Не удалось опубликовать пост:\n{post.title[:50]}...\n{error}", parse_mode=None)
+        finally:
+            self._inflight.discard(job_id)
+    
+    async def _notify_admin(self, text: str, parse_mode: Optional[str] = ParseMode.HTML) -> None:
+        """Message admin chat; a failed notice is only logged"""
+        if not self.state_manager.config.admin_chat_id:
+            return
+        
+        try:
+            await self.admin_bot.send_message(
+                self.state_manager.config.admin_chat_id,
+                text,
+                parse_mode=parse_mode
+            )
+        except TelegramError as e:
+            logging.error(f"Error notifying admin: {e}")
+    
+    def _finish_sent(self, post: Post) -> None:
+        """Post-level bookkeeping of a delivered post, safe to repeat
+        
+        A restart between the job's "sent" write and this step leaves the
+        post pending; publishing it again completes the step instead of
+        sending.
+        """
+        if self.state_manager.has_pending_post(post.id) or not self.state_manager.is_link_sent(post.link):
             self.state_manager.mark_post_as_sent(post)
+    
+    @staticmethod
+    def _is_due(job: Dict[str, Any]) -> bool:
+        """Job's next attempt time has come"""
+        return datetime.fromisoformat(job["next_attempt"]) <= datetime.now(timezone.utc)
+    
+    @staticmethod
+    def _backoff(attempts: int) -> float:
+        """Delay before next attempt after given number of failed attempts"""
+        return min(OUTBOX_BASE_DELAY_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_DELAY_SECONDS)
+    
+    async def _recover_outbox(self) -> None:
+        """Resume jobs interrupted by restart and drop old finished ones
+        
+        A job left in "sending" may or may not have reached Telegram. Each job
+        is marked sent, with its message ids, as soon as its own send returns,
+        so a job still "sending" is sent again: a rare duplicate is preferred
+        over a lost post. The post's sent link says nothing about a channel,
+        in fan-out it is set by whichever channel went first.
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=OUTBOX_RETENTION_DAYS)).isoformat()
+        
+        for job in list(self.state_manager.get_outbox_jobs().values()):
+            if job["state"] in (JOB_SENT, JOB_FAILED):
+                if job["updated"] < cutoff:
+                    self.state_manager.remove_outbox_job(job["id"])
+            elif job["state"] == JOB_SENDING:
+                logging.warning(f"Resuming interrupted publish of {job['post_id']} to {job['channel']}")
+                self._set_job_state(job, JOB_QUEUED)
+        
+        await self.state_manager.aflush()
+    
+    async def run_outbox(self) -> None:
+        """Deliver queued outbox jobs, waking at the earliest retry time"""
+        while True:
+            now = datetime.now(timezone.utc)
+            next_due: Optional[datetime] = None
             
-            logging.info(f"Successfully published: {post.title[:50]}")
-            return True
+            for job in list(self.state_manager.get_outbox_jobs().values()):
+                if job["state"] != JOB_QUEUED or job["id"] in self._inflight:
+                    continue
+                due = datetime.fromisoformat(job["next_attempt"])
+                if due <= now:
+                    try:
+                        await self._process_job(job["id"])
+                    except Exception as e:
+                        logging.error(f"Error processing outbox job {job['id']}: {e}")
+                elif next_due is None or due < next_due:
+                    next_due = due
             
-        except TelegramError as e:
-            logging.error(f"Telegram error publishing: {e}")
-            return False
-        except Exception as e:
-            logging.error(f"Unexpected error publishing: {e}")
-            return False
+            timeout = None if next_due is None else max(0.0, (next_due - now).total_seconds())
+            try:
+                await asyncio.wait_for(self._outbox_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._outbox_changed.clear()
     
     async def publish_thought(self, thought: ThoughtPost, channel: Optional[str] = None) -> bool:
         """Publish thought post"""
@@ -77,85 +494,142 @@ class PublisherService:
         
         try:
             if thought.image_url:
-                await self.bot.send_photo(
+                await self.image_service.send_photo(
+                    self.channel_bot,
                     channel,
                     thought.image_url,
-                    caption=thought.text,
-                    parse_mode=ParseMode.HTML
+                    thought.text
                 )
             else:
-                await self.bot.send_message(
+                await self.channel_bot.send_message(
                     channel,
                     thought.text,
                     parse_mode=ParseMode.HTML
                 )
             
             return True
-            
+        
         except Exception as e:
             logging.error(f"Error publishing thought: {e}")
             return False
     
     async def check_and_publish_scheduled(self) -> List[str]:
-        """Check and publish scheduled posts"""
+        """Publish scheduled posts that are due
+        
+        Each due post is handled on its own: one that fails or raises goes
+        back to the schedule heap for a retry, the others are still published.
+        """
         published_ids = []
         
-        for post_id, scheduled in list(self.state_manager.state.scheduled_posts.items()):
-            if scheduled.is_ready():
-                success = await self.publish_post(scheduled.record)
-                
-                if success:
-                    published_ids.append(post_id)
-                    self.state_manager.unschedule_post(post_id)
-                    
-                    logging.info(f"Published scheduled post: {scheduled.record.title[:50]}")
-                    
-                    # Notify admin
-                    if self.state_manager.config.admin_chat_id:
-                        await self.bot.send_message(
-                            self.state_manager.config.admin_chat_id,
-                            f"✅ Запланированный пост опубликован:\n{scheduled.record.title[:50]}...",
-                            parse_mode=ParseMode.HTML
-                        )
+        # Only due entries are taken from the schedule heap, nothing else is parsed
+        for post_id in self.state_manager.pop_due_scheduled():
+            try:
+                success = await self._publish_scheduled(post_id)
+            except Exception as e:
+                logging.error(f"Error publishing scheduled post {post_id}: {e}")
+                success = False
+            
+            if success:
+                published_ids.append(post_id)
+            elif self.state_manager.get_scheduled_post(post_id):
+                self.state_manager.defer_scheduled_post(post_id, SCHEDULE_RETRY_SECONDS)
         
         return published_ids
     
+    async def _publish_scheduled(self, post_id: str) -> bool:
+        """Publish one due scheduled post and take it off the schedule"""
+        scheduled = self.state_manager.get_scheduled_post(post_id)
+        if not scheduled:
+            return False
+        
+        if not await self.publish_post(scheduled.record):
+            return False
+        
+        self.state_manager.remove_scheduled_post(post_id)
+        logging.info(f"Published scheduled post: {scheduled.record.title[:50]}")
+        
+        # Notify admin; the post is out already, a failed notice changes nothing
+        await self._notify_admin(f"✅ Запланированный пост опубликован:\n{scheduled.record.title[:50]}...")
+        
+        return True
+    
+    async def run_scheduler(self) -> None:
+        """Publish scheduled posts exactly when they are due
+        
+        Sleeps until the earliest due time instead of polling; adding, editing
+        or removing a schedule wakes the loop to recompute the deadline.
+        """
+        while True:
+            try:
+                await self.check_and_publish_scheduled()
+            except Exception as e:
+                logging.error(f"Error publishing scheduled posts: {e}")
+            
+            await self.state_manager.wait_schedule_change(
+                self.state_manager.seconds_until_next_scheduled()
+            )
+    
     async def auto_publish_next_favorite(self) -> Optional[str]:
-        """Auto-publish next post from favorites"""
-        if not self.state_manager.state.auto_publish:
+        """Auto-publish next post from favorites if its slot has come
+        
+        A post that fails for good stays in favorites and the slot is
+        retried later. The admin hears about the post once it is delivered,
+        which may be on a later outbox retry.
+        """
+        if not self.state_manager.get("auto_publish"):
+            return None
+        
+        if self.planner.next_slot() > datetime.now(timezone.utc):
+            return None
+        
+        fav_id = self.state_manager.next_favorite()
+        if not fav_id:
+            return None
+        
+        post = self.state_manager.get_post(fav_id)
+        success = await self.publish_post(
+            post,
+            notice=f"🤖 Автоматически опубликован пост из избранного:\n{post.title[:50]}..."
+        )
+        if not success:
+            logging.error(f"Auto-publish failed, kept in favorites: {post.title[:50]}")
             return None
         
-        # Check interval
-        last_publish = self.state_manager.state.last_auto_publish
-        if last_publish:
-            last_time = datetime.fromisoformat(last_publish.replace('Z', '+00:00'))
-            interval = self.state_manager.state.publish_interval
-            if (datetime.now(timezone.utc) - last_time).seconds < interval:
-                return None
-        
-        # Find post from favorites
-        for fav_id in self.state_manager.state.favorites:
-            post = self.state_manager.get_post(fav_id)
-            if post:
-                success = await self.publish_post(post)
-                
-                if success:
-                    # Update state
-                    self.state_manager.state.last_auto_publish = datetime.now(timezone.utc).isoformat()
-                    self.state_manager.state.favorites.remove(fav_id)
-                    self.state_manager.save_state()
+        # Sent or handed to the outbox, which retries it: the slot is used
+        self.state_manager.remove_favorite(fav_id)
+        self.state_manager.set("last_auto_publish", datetime.now(timezone.utc).isoformat())
+        return fav_id
+    
+    async def run_auto_publish(self) -> None:
+        """Publish favorites at planned slots
+        
+        Sleeps until the next slot; toggling favorites, changing settings
+        or the schedule wakes the loop to plan again. A failed slot is
+        retried with growing delays instead of moving on to the next post.
+        """
+        while True:
+            timeout = None
+            if self.state_manager.get("auto_publish") and self.state_manager.next_favorite():
+                delay = (self.planner.next_slot() - datetime.now(timezone.utc)).total_seconds()
+                if delay <= 0:
+                    try:
+                        published = await self.auto_publish_next_favorite()
+                    except Exception as e:
+                        logging.error(f"Error auto-publishing favorite: {e}")
+                        published = None
                     
-                    # Notify admin
-                    if self.state_manager.config.admin_chat_id:
-                        await self.bot.send_message(
-                            self.state_manager.config.admin_chat_id,
-                            f"🤖 Автоматически опубликован пост из избранного:\n{post.title[:50]}...",
-                            parse_mode=ParseMode.HTML
-                        )
+                    if published:
+                        self._auto_failures = 0
+                        continue
                     
-                    return fav_id
-        
-        return None
+                    self._auto_failures += 1
+                    delay = min(
+                        SCHEDULE_RETRY_SECONDS * 2 ** (self._auto_failures - 1),
+                        OUTBOX_MAX_DELAY_SECONDS
+                    )
+                timeout = delay
+            
+            await self.state_manager.wait_planner_change(timeout)
     
     async def send_for_moderation(
         self,
@@ -178,7 +652,8 @@ class PublisherService:
                 self.state_manager.state.timezone
             )
             
-            generated_count = len(self.state_manager.state.generated_images.get(post.id, []))
+            generated_images = self.state_manager.get_generated_images(post.id)
+            generated_count = len(generated_images)
             original_count = len(post.images)
             
             text = format_moderation_text(
@@ -190,19 +665,17 @@ class PublisherService:
             )
             
             # Send media if available
-            generated_images = self.state_manager.state.generated_images.get(post.id, [])
-            media = self.image_service.build_media_group(
+            await self.image_service.send_media_group(
+                self.admin_bot,
+                admin_chat_id,
                 post,
                 generated_images,
                 for_channel=False
             )
             
-            if media:
-                await self.bot.send_media_group(admin_chat_id, media)
-            
             # Send moderation message
             keyboard = create_moderation_keyboard(post.id)
-            await self.bot.send_message(
+            await self.admin_bot.send_message(
                 admin_chat_id,
                 text,
                 reply_markup=keyboard,
@@ -211,7 +684,7 @@ class PublisherService:
             )
             
             return True
-            
+        
         except TelegramError as e:
             logging.error(f"Telegram error sending for moderation: {e}")
             return False
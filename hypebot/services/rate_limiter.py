@@ -0,0 +1,194 @@
+"""
+Rate limiting for OpenAI requests and Telegram sends
+"""
+import asyncio
+import bisect
+import heapq
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+
+# Request priorities, lower goes first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at a per-minute rate
+    
+    Holds up to burst tokens (a full minute by default). Requests larger
+    than the bucket wait for a full bucket and leave it in debt, so they
+    are still paid for in full.
+    """
+    
+    def __init__(self, per_minute: Optional[float], burst: Optional[float] = None):
+        self.rate = per_minute / 60 if per_minute else None
+        self.capacity = float(burst or per_minute) if per_minute else None
+        self.level = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self, now: float) -> None:
+        """Add tokens accrued since last update"""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def wait_time(self, amount: int) -> float:
+        """Seconds until amount is available, 0 if available now"""
+        if self.capacity is None:
+            return 0.0
+        
+        self._refill(time.monotonic())
+        
+        # Requests larger than the bucket wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+    
+    def consume(self, amount: int) -> None:
+        """Take tokens out of the bucket"""
+        if self.capacity is None:
+            return
+        self._refill(time.monotonic())
+        self.level -= amount
+
+
+class RequestScheduler:
+    """Priority queue in front of one kind of API call
+    
+    Waiting requests are served strictly by (priority, arrival) order as the
+    request and token buckets allow, so interactive calls overtake queued
+    background ones.
+    """
+    
+    def __init__(self, name: str, rpm: Optional[int], tpm: Optional[int] = None):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._waiting: List[Tuple[int, int]] = []
+        self._counter = itertools.count()
+        self._condition = asyncio.Condition()
+        self._paused_until = 0.0
+    
+    def pause(self, seconds: float) -> None:
+        """Hold all requests, e.g. after 429 with Retry-After"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def _wait_time(self, tokens: int) -> float:
+        """Seconds until a request of given size may start"""
+        return max(
+            self._paused_until - time.monotonic(),
+            self.requests.wait_time(1),
+            self.tokens.wait_time(tokens)
+        )
+    
+    async def acquire(self, tokens: int, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait for our turn and capacity, then spend it"""
+        entry = (priority, next(self._counter))
+        
+        async with self._condition:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    delay = None
+                    if self._waiting[0] == entry:
+                        delay = self._wait_time(tokens)
+                        if delay <= 0:
+                            break
+                    
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+            
+            heapq.heappop(self._waiting)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+            self._condition.notify_all()
+
+
+class SendThrottler:
+    """Priority queue of Telegram sends under global and per-chat limits
+    
+    Each send costs weight messages (a media group costs one per item) of
+    both the global budget and its chat's budget. The best-priority send
+    whose chat has budget goes next, so a chat waiting out its own limit
+    does not hold up sends to other chats.
+    """
+    
+    def __init__(
+        self,
+        per_second: float,
+        group_per_minute: float,
+        private_per_minute: float,
+        chat_burst: float
+    ):
+        self.global_bucket = TokenBucket(per_second * 60, burst=per_second)
+        self.group_per_minute = group_per_minute
+        self.private_per_minute = private_per_minute
+        self.chat_burst = chat_burst
+        self._chats: Dict[str, TokenBucket] = {}
+        # Sorted [(priority, arrival, chat, weight)]
+        self._waiting: List[Tuple[int, int, str, int]] = []
+        self._counter = itertools.count()
+        self._condition = asyncio.Condition()
+        self._paused_until = 0.0
+    
+    def pause(self, seconds: float) -> None:
+        """Hold all sends, e.g. after RetryAfter"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+    
+    def _chat_bucket(self, chat: str) -> TokenBucket:
+        """Budget of chat: channels and groups ("@name", negative id) are slower than private chats"""
+        bucket = self._chats.get(chat)
+        if bucket is None:
+            is_private = chat.isdigit()
+            per_minute = self.private_per_minute if is_private else self.group_per_minute
+            bucket = self._chats[chat] = TokenBucket(per_minute, burst=self.chat_burst)
+        return bucket
+    
+    def _wait_time(self, entry: Tuple[int, int, str, int]) -> Optional[float]:
+        """Seconds until entry may be sent, None while an earlier send goes first"""
+        for waiting in self._waiting:
+            chat_delay = self._chat_bucket(waiting[2]).wait_time(waiting[3])
+            if waiting is entry:
+                return max(
+                    chat_delay,
+                    self._paused_until - time.monotonic(),
+                    self.global_bucket.wait_time(entry[3])
+                )
+            if chat_delay <= 0:
+                return None
+        return None
+    
+    async def acquire(self, chat_id: Union[int, str], weight: int = 1, priority: int = PRIORITY_INTERACTIVE) -> None:
+        """Wait for our turn and budget, then spend it"""
+        entry = (priority, next(self._counter), str(chat_id), weight)
+        
+        async with self._condition:
+            bisect.insort(self._waiting, entry)
+            try:
+                while True:
+                    delay = self._wait_time(entry)
+                    if delay is not None and delay <= 0:
+                        break
+                    
+                    try:
+                        await asyncio.wait_for(self._condition.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                self._waiting.remove(entry)
+                self._condition.notify_all()
+                raise
+            
+            self._waiting.remove(entry)
+            self._chat_bucket(entry[2]).consume(weight)
+            self.global_bucket.consume(weight)
+            self._condition.notify_all()
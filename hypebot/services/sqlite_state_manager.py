@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+SQLite-бэкенд менеджера состояния
+"""
+
+import json
+import logging
+import sqlite3
+from typing import Dict, List, Any, Optional, Set, Tuple
+from datetime import datetime, timezone, timedelta
+
+from models.post import Post
+from models.schedule import ScheduledPost
+from config.settings import settings
+from services.state_manager import StateManager, TAG_FIELDS
+from utils.scoring import HOT_TAG_TYPES
+from utils.validators import normalize_link
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending_posts (
+    id TEXT PRIMARY KEY,
+    link TEXT NOT NULL,
+    source TEXT,
+    category TEXT,
+    timestamp TEXT,
+    score REAL NOT NULL DEFAULT 0,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_pending_timestamp ON pending_posts(timestamp);
+CREATE INDEX IF NOT EXISTS idx_pending_source ON pending_posts(source);
+CREATE INDEX IF NOT EXISTS idx_pending_category ON pending_posts(category);
+
+CREATE TABLE IF NOT EXISTS post_tags (
+    post_id TEXT NOT NULL REFERENCES pending_posts(id) ON DELETE CASCADE,
+    tag_type TEXT NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (post_id, tag_type, tag)
+);
+CREATE INDEX IF NOT EXISTS idx_post_tags_tag ON post_tags(tag_type, tag);
+
+CREATE TABLE IF NOT EXISTS scheduled_posts (
+    post_id TEXT PRIMARY KEY,
+    time TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scheduled_time ON scheduled_posts(time);
+
+CREATE TABLE IF NOT EXISTS generated_images (
+    post_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    PRIMARY KEY (post_id, position)
+);
+
+CREATE TABLE IF NOT EXISTS sent_links (
+    link TEXT PRIMARY KEY,
+    sent_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_sent_links_sent_at ON sent_links(sent_at);
+"""
+
+# Версия данных в базе (PRAGMA user_version): при повышении данные мигрируют один раз
+SCHEMA_VERSION = 1
+
+
+def db_timestamp(timestamp: Optional[str]) -> Optional[str]:
+    """Время поста в едином виде UTC, чтобы сравнивать и сортировать строки в SQL
+    
+    Время без зоны считается UTC; неразборчивое время - NULL, такой пост
+    не устаревает по возрасту.
+    """
+    try:
+        moment = datetime.fromisoformat((timestamp or "").replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+class SqliteStateManager(StateManager):
+    """Менеджер состояния с постами, расписанием, обложками и ссылками в SQLite
+    
+    Настройки и флаги ожидания остаются в state.json, а объемные коллекции
+    читаются из базы по запросу, а не загружаются целиком при старте.
+    """
+    
+    def __init__(self, state_file: str = "state.json", db_file: str = "state.db"):
+        self.db_file = db_file
+        self.db = sqlite3.connect(db_file)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA foreign_keys=ON")
+        self.db.executescript(SCHEMA)
+        self._migrate_schema()
+        
+        super().__init__(state_file)
+        
+        self._import_legacy_state()
+        self.clean_old_posts()
+    
+    def _migrate_schema(self) -> None:
+        """Привести базу прежней версии к текущей схеме
+        
+        Оценки хранятся в столбце score, а время в столбце timestamp - в
+        едином виде UTC. Пересчет всей очереди нужен только после миграции,
+        при обычном старте база читается как есть.
+        """
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        self._rescore_all = version < SCHEMA_VERSION
+        if not self._rescore_all:
+            return
+        
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(pending_posts)")}
+        with self.db:
+            if "score" not in columns:
+                self.db.execute("ALTER TABLE pending_posts ADD COLUMN score REAL NOT NULL DEFAULT 0")
+            self.db.execute("CREATE INDEX IF NOT EXISTS idx_pending_score ON pending_posts(score)")
+            
+            rows = self.db.execute("SELECT id, data FROM pending_posts").fetchall()
+            self.db.executemany(
+                "UPDATE pending_posts SET timestamp = ? WHERE id = ?",
+                [(db_timestamp(json.loads(row["data"]).get("timestamp")), row["id"]) for row in rows]
+            )
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    
+    def _import_legacy_state(self) -> None:
+        """Перенос коллекций из state.json в базу"""
+        pending = self.state.get("pending") or {}
+        scheduled = self.state.get("scheduled_posts") or {}
+        generated = self.state.get("generated_images") or {}
+        sent_links = self.state.get("sent_links") or {}
+        
+        if not (pending or scheduled or generated or sent_links):
+            return
+        
+        with self.db:
+            for post_data in pending.values():
+                self._upsert_post(Post.from_dict(post_data))
+            for post_id, data in scheduled.items():
+                self._upsert_scheduled(post_id, data)
+            for post_id, images in generated.items():
+                for position, url in enumerate(images):
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO generated_images (post_id, position, url) VALUES (?, ?, ?)",
+                        (post_id, position, url)
+                    )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sent_links (link, sent_at) VALUES (?, ?)",
+                list(sent_links.items())
+            )
+        
+        logging.info(
+            f"Перенесено в SQLite: {len(pending)} постов, {len(scheduled)} запланированных, "
+            f"{len(sent_links)} ссылок"
+        )
+        
+        self.state.update({
+            "pending": {},
+            "scheduled_posts": {},
+            "generated_images": {},
+            "sent_links": {}
+        })
+        self.save_state()
+        self._rebuild_schedule()
+    
+    def clean_old_posts(self, state: Optional[Dict[str, Any]] = None) -> int:
+        """Очистка старых постов из очереди"""
+        if state is not None:
+            # Вызов при загрузке state.json: очередь в базе чистится после инициализации
+            return 0
+        
+        # Возраст больше max_post_age_days полных суток, как в StateManager
+        cutoff = (
+            datetime.now(timezone.utc) - timedelta(days=settings.max_post_age_days + 1)
+        ).isoformat(timespec="microseconds")
+        
+        # Время в базе в едином виде UTC: устаревшие находит индекс по timestamp
+        expired = [
+            row["id"]
+            for row in self.db.execute("SELECT id FROM pending_posts WHERE timestamp < ?", (cutoff,))
+        ]
+        
+        with self.db:
+            if expired:
+                peers = self._hot_peers_of(expired)
+                self.db.execute("DELETE FROM pending_posts WHERE timestamp < ?", (cutoff,))
+                self._rescore(peers - set(expired))
+            
+            # Ограничиваем количество постов, оставляя самые значимые
+            removed_count = len(expired) + self._trim_pending()
+        
+        for post_id in expired:
+            self.remove_favorite(post_id)
+        
+        if removed_count > 0:
+            logging.info(f"Удалено {removed_count} старых постов")
+        
+        return removed_count
+    
+    # Посты в очереди
+    def _upsert_post(self, post: Post) -> None:
+        """Записать пост и его теги"""
+        peers = self._hot_peers(post.id)
+        
+        self.db.execute(
+            "INSERT INTO pending_posts (id, link, source, category, timestamp, data) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET link = excluded.link, source = excluded.source, "
+            "category = excluded.category, timestamp = excluded.timestamp, data = excluded.data",
+            (
+                post.id, post.link, post.source, post.category, db_timestamp(post.timestamp),
+                json.dumps(post.to_dict(), ensure_ascii=False, default=str)
+            )
+        )
+        
+        self.db.execute("DELETE FROM post_tags WHERE post_id = ?", (post.id,))
+        if post.tags:
+            tags = post.tags.to_dict()
+            self.db.executemany(
+                "INSERT OR IGNORE INTO post_tags (post_id, tag_type, tag) VALUES (?, ?, ?)",
+                [
+                    (post.id, tag_type, tag)
+                    for tag_type, field in TAG_FIELDS.items()
+                    for tag in tags.get(field, [])
+                ]
+            )
+        
+        self._update_score(post.id, post.to_dict())
+        self._rescore(peers | self._hot_peers(post.id))
+    
+    def _delete_post(self, post_id: str) -> None:
+        """Удалить пост с тегами и пересчитать оценки соседей по тегам"""
+        peers = self._hot_peers(post_id)
+        self.db.execute("DELETE FROM pending_posts WHERE id = ?", (post_id,))
+        self._rescore(peers)
+    
+    def add_pending_post(self, post: Post) -> None:
+        """Добавить пост в очередь"""
+        with self.db:
+            self._upsert_post(post)
+            self._trim_pending()
+    
+    def get_pending_post(self, post_id: str) -> Optional[Post]:
+        """Получить пост из очереди"""
+        row = self.db.execute(
+            "SELECT data FROM pending_posts WHERE id = ?", (post_id,)
+        ).fetchone()
+        return Post.from_dict(json.loads(row["data"])) if row else None
+    
+    def has_pending_post(self, post_id: str) -> bool:
+        """Проверить, есть ли пост в очереди"""
+        row = self.db.execute(
+            "SELECT 1 FROM pending_posts WHERE id = ?", (post_id,)
+        ).fetchone()
+        return row is not None
+    
+    def get_pending_posts(
+        self,
+        source: Optional[str] = None,
+        category: Optional[str] = None,
+        tag_type: Optional[str] = None,
+        tag_value: Optional[str] = None
+    ) -> List[Post]:
+        """Получить посты из очереди с фильтрами, новые первыми"""
+        query = "SELECT p.data FROM pending_posts p"
+        conditions = []
+        params: List[Any] = []
+        
+        if tag_type:
+            query += " JOIN post_tags t ON t.post_id = p.id"
+            conditions.append("t.tag_type = ? AND t.tag = ?")
+            params.extend([tag_type, tag_value])
+        if source:
+            conditions.append("p.source = ?")
+            params.append(source)
+        if category:
+            conditions.append("p.category = ?")
+            params.append(category)
+        
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY p.timestamp DESC"
+        
+        return [
+            Post.from_dict(json.loads(row["data"]))
+            for row in self.db.execute(query, params)
+        ]
+    
+    def _rebuild_tag_index(self) -> None:
+        """Индекс тегов - таблица post_tags, в памяти не держим"""
+    
+    # Рейтинг очереди - индексированный столбец score
+    def _update_score(self, post_id: str, post_data: Dict[str, Any]) -> None:
+        """Пересчитать оценку поста по его тегам в базе"""
+        row = self.db.execute(
+            "SELECT MAX(n) AS hotness FROM ("
+            "SELECT COUNT(*) - 1 AS n FROM post_tags WHERE (tag_type, tag) IN "
+            "(SELECT tag_type, tag FROM post_tags WHERE post_id = ?) "
+            f"AND tag_type IN ({', '.join('?' * len(HOT_TAG_TYPES))}) "
+            "GROUP BY tag_type, tag)",
+            (post_id, *HOT_TAG_TYPES)
+        ).fetchone()
+        score = self._score(post_data, row["hotness"] or 0)
+        self.db.execute("UPDATE pending_posts SET score = ? WHERE id = ?", (score, post_id))
+    
+    def _hot_peers(self, post_id: str) -> Set[str]:
+        """Другие посты с тем же брендом или моделью"""
+        return self._hot_peers_of([post_id]) - {post_id}
+    
+    def _hot_peers_of(self, post_ids: List[str]) -> Set[str]:
+        """Посты с брендом или моделью одного из post_ids, включая их самих"""
+        rows = self.db.execute(
+            "SELECT DISTINCT post_id FROM post_tags WHERE (tag_type, tag) IN "
+            f"(SELECT tag_type, tag FROM post_tags WHERE post_id IN ({', '.join('?' * len(post_ids))}) "
+            f"AND tag_type IN ({', '.join('?' * len(HOT_TAG_TYPES))}))",
+            (*post_ids, *HOT_TAG_TYPES)
+        )
+        return {row["post_id"] for row in rows}
+    
+    def _rescore(self, post_ids: Set[str]) -> None:
+        """Пересчитать оценки постов: популярность их тегов изменилась"""
+        if not post_ids:
+            return
+        rows = self.db.execute(
+            f"SELECT id, data FROM pending_posts WHERE id IN ({', '.join('?' * len(post_ids))})",
+            list(post_ids)
+        ).fetchall()
+        for row in rows:
+            self._update_score(row["id"], json.loads(row["data"]))
+    
+    def _rebuild_ranking(self) -> None:
+        """Пересчитать оценки всей очереди, только после миграции схемы
+        
+        Время само по себе порядок не меняет (см. post_score), а популярность
+        тегов пересчитывается при каждом изменении очереди, поэтому
+        сохраненные оценки остаются верными между запусками.
+        """
+        if not self._rescore_all:
+            return
+        rows = self.db.execute("SELECT id, data FROM pending_posts").fetchall()
+        with self.db:
+            for row in rows:
+                self._update_score(row["id"], json.loads(row["data"]))
+        self._rescore_all = False
+    
+    def _trim_pending(self) -> int:
+        """Вытеснить наименее значимые посты сверх лимита очереди"""
+        excess = self.db.execute("SELECT COUNT(*) FROM pending_posts").fetchone()[0] - settings.max_pending_posts
+        for _ in range(max(0, excess)):
+            # По одному: удаление меняет оценки соседей
+            post_id = self.db.execute(
+                "SELECT id FROM pending_posts ORDER BY score ASC LIMIT 1"
+            ).fetchone()["id"]
+            logging.info(f"Очередь переполнена, удаляем наименее значимый пост {post_id}")
+            self._delete_post(post_id)
+            self.remove_favorite(post_id)
+        return max(0, excess)
+    
+    def get_post_score(self, post_id: str) -> Optional[float]:
+        """Оценка поста в очереди"""
+        row = self.db.execute(
+            "SELECT score FROM pending_posts WHERE id = ?", (post_id,)
+        ).fetchone()
+        return row["score"] if row else None
+    
+    def get_top_pending_ids(
+        self,
+        limit: Optional[int] = None,
+        among: Optional[Set[str]] = None
+    ) -> List[str]:
+        """Посты очереди от самых значимых, при необходимости только из among"""
+        query = "SELECT id FROM pending_posts"
+        params: List[Any] = []
+        if among is not None:
+            if not among:
+                return []
+            query += f" WHERE id IN ({', '.join('?' * len(among))})"
+            params.extend(among)
+        query += " ORDER BY score DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        return [row["id"] for row in self.db.execute(query, params)]
+    
+    def get_pending_tags(self) -> Dict[str, List[str]]:
+        """Все теги постов в очереди, по типам"""
+        result: Dict[str, List[str]] = {field: [] for field in TAG_FIELDS.values()}
+        for row in self.db.execute("SELECT DISTINCT tag_type, tag FROM post_tags ORDER BY tag"):
+            if row["tag_type"] in TAG_FIELDS:
+                result[TAG_FIELDS[row["tag_type"]]].append(row["tag"])
+        return result
+    
+    def find_pending_ids(self, tags: List[Tuple[str, str]], match_all: bool = True) -> List[str]:
+        """Найти посты по тегам (И / ИЛИ), новые первыми"""
+        tags = list(set(tags))
+        if not tags:
+            return []
+        
+        conditions = " OR ".join(["(t.tag_type = ? AND t.tag = ?)"] * len(tags))
+        query = (
+            "SELECT p.id FROM pending_posts p JOIN post_tags t ON t.post_id = p.id "
+            f"WHERE {conditions} GROUP BY p.id"
+        )
+        params: List[Any] = [value for tag in tags for value in tag]
+        if match_all:
+            query += " HAVING COUNT(*) = ?"
+            params.append(len(tags))
+        query += " ORDER BY p.timestamp DESC"
+        
+        return [row["id"] for row in self.db.execute(query, params)]
+    
+    def get_post(self, post_id: str) -> Optional[Post]:
+        """Получить пост из очереди или из расписания"""
+        post = self.get_pending_post(post_id)
+        if post:
+            return post
+        
+        row = self.db.execute(
+            "SELECT data FROM scheduled_posts WHERE post_id = ?", (post_id,)
+        ).fetchone()
+        return Post.from_dict(json.loads(row["data"])["record"]) if row else None
+    
+    def remove_pending_post(self, post_id: str) -> None:
+        """Удалить пост из очереди"""
+        with self.db:
+            self._delete_post(post_id)
+        self.remove_favorite(post_id)
+    
+    # Отправленные ссылки
+    def add_sent_link(self, link: str) -> None:
+        """Добавить ссылку в отправленные"""
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO sent_links (link, sent_at) VALUES (?, ?)",
+                (normalize_link(link), datetime.now(timezone.utc).isoformat())
+            )
+            self._evict_db_sent_links()
+    
+    def is_link_sent(self, link: str) -> bool:
+        """Проверить, была ли ссылка отправлена"""
+        row = self.db.execute(
+            "SELECT 1 FROM sent_links WHERE link = ?", (normalize_link(link),)
+        ).fetchone()
+        return row is not None
+    
+    def _evict_db_sent_links(self) -> None:
+        """Вытеснение самых старых ссылок по возрасту и лимиту размера"""
+        cutoff = (
+            datetime.now(timezone.utc) - timedelta(days=settings.sent_links_max_age_days)
+        ).isoformat()
+        self.db.execute("DELETE FROM sent_links WHERE sent_at < ?", (cutoff,))
+        
+        count = self.db.execute("SELECT COUNT(*) FROM sent_links").fetchone()[0]
+        if count > settings.max_sent_links:
+            self.db.execute(
+                "DELETE FROM sent_links WHERE link IN "
+                "(SELECT link FROM sent_links ORDER BY sent_at ASC LIMIT ?)",
+                (count - settings.max_sent_links,)
+            )
+    
+    # Запланированные посты
+    def _upsert_scheduled(self, post_id: str, data: Dict[str, Any]) -> None:
+        """Записать запланированный пост"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO scheduled_posts (post_id, time, data) VALUES (?, ?, ?)",
+            (post_id, data["time"], json.dumps(data, ensure_ascii=False, default=str))
+        )
+    
+    def add_scheduled_post(self, post_id: str, scheduled_post: ScheduledPost) -> None:
+        """Добавить запланированный пост"""
+        with self.db:
+            self._upsert_scheduled(post_id, scheduled_post.to_dict())
+        self._schedule_push(post_id, scheduled_post)
+    
+    def get_scheduled_post(self, post_id: str) -> Optional[ScheduledPost]:
+        """Получить запланированный пост"""
+        row = self.db.execute(
+            "SELECT data FROM scheduled_posts WHERE post_id = ?", (post_id,)
+        ).fetchone()
+        return ScheduledPost.from_dict(json.loads(row["data"])) if row else None
+    
+    def get_scheduled_posts(self) -> Dict[str, ScheduledPost]:
+        """Получить все запланированные посты"""
+        result = {}
+        for row in self.db.execute("SELECT post_id, data FROM scheduled_posts ORDER BY time"):
+            try:
+                result[row["post_id"]] = ScheduledPost.from_dict(json.loads(row["data"]))
+            except Exception as e:
+                logging.error(f"Ошибка при загрузке запланированного поста {row['post_id']}: {e}")
+        return result
+    
+    def remove_scheduled_post(self, post_id: str) -> None:
+        """Удалить запланированный пост"""
+        with self.db:
+            self.db.execute("DELETE FROM scheduled_posts WHERE post_id = ?", (post_id,))
+        self._schedule_discard(post_id)
+    
+    # Сгенерированные изображения
+    def add_generated_image(self, post_id: str, image_url: str) -> None:
+        """Добавить сгенерированное изображение к посту"""
+        with self.db:
+            self.db.execute(
+                "INSERT INTO generated_images (post_id, position, url) VALUES "
+                "(?, (SELECT COALESCE(MAX(position) + 1, 0) FROM generated_images WHERE post_id = ?), ?)",
+                (post_id, post_id, image_url)
+            )
+    
+    def get_generated_images(self, post_id: str) -> List[str]:
+        """Получить сгенерированные изображения поста"""
+        return [
+            row["url"]
+            for row in self.db.execute(
+                "SELECT url FROM generated_images WHERE post_id = ? ORDER BY position",
+                (post_id,)
+            )
+        ]
+    
+    def clear_generated_images(self, post_id: str) -> None:
+        """Удалить сгенерированные изображения поста"""
+        with self.db:
+            self.db.execute("DELETE FROM generated_images WHERE post_id = ?", (post_id,))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика по очереди и публикациям"""
+        def count(table: str) -> int:
+            return self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        
+        brand_stats = {
+            row["tag"]: row["cnt"]
+            for row in self.db.execute(
+                "SELECT tag, COUNT(*) AS cnt FROM post_tags WHERE tag_type = 'brand' GROUP BY tag"
+            )
+        }
+        source_stats = {
+            row["source"]: row["cnt"]
+            for row in self.db.execute(
+                "SELECT COALESCE(source, 'Unknown') AS source, COUNT(*) AS cnt "
+                "FROM pending_posts GROUP BY source"
+            )
+        }
+        
+        return {
+            "pending_count": count("pending_posts"),
+            "sent_count": count("sent_links"),
+            "scheduled_count": count("scheduled_posts"),
+            "favorites_count": len(self.state.get("favorites", [])),
+            "brand_stats": brand_stats,
+            "source_stats": source_stats
+        }
+    
+    async def close(self) -> None:
+        """Дописать отложенные изменения и закрыть соединение с базой"""
+        await super().close()
+        self.db.close()
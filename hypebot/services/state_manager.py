@@ -3,15 +3,36 @@
 Сервис управления состоянием приложения
 """
 
+import asyncio
+import bisect
+import heapq
 import json
 import logging
-from typing import Dict, List, Any, Optional
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Any, Optional, Set, Tuple
 from datetime import datetime, timezone, timedelta
 from pathlib import Path
 
 from models.post import Post
 from models.schedule import ScheduledPost
 from config.settings import settings
+from config.sources import SOURCES
+from utils.scoring import HOT_TAG_TYPES, post_score, source_weights
+from utils.validators import normalize_link
+
+
+# Тип фильтра -> поле PostTags
+TAG_FIELDS = {
+    "brand": "brands",
+    "model": "models",
+    "type": "types",
+    "color": "colors"
+}
+
+# Имя источника -> множитель значимости его постов
+SOURCE_WEIGHTS = source_weights(SOURCES)
 
 
 class StateManager:
@@ -19,7 +40,41 @@ class StateManager:
     
     def __init__(self, state_file: str = "state.json"):
         self.state_file = state_file
+        self.journal_file = f"{state_file}.journal"
+        self._journal_records = 0
+        
+        # Отложенная запись: изменения копятся и сбрасываются одной пачкой
+        self._pending_records: List[Dict[str, Any]] = []
+        self._snapshot_dirty = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_now = asyncio.Event()
+        
+        # Один поток записи: файловый ввод-вывод вне event loop и строго по порядку
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-writer")
+        
+        # Инвертированный индекс тегов: (тип, тег) -> [(timestamp, id)] по возрастанию
+        self._tag_index: Dict[Tuple[str, str], List[Tuple[str, str]]] = {}
+        
+        # Рейтинг очереди: [(score, id)] по возрастанию, наименее значимые в начале
+        self._ranking: List[Tuple[float, str]] = []
+        self._scores: Dict[str, float] = {}
+        
+        # Расписание: куча [(время, id)] с ленивым удалением устаревших записей
+        self._schedule_heap: List[Tuple[float, str]] = []
+        self._schedule_times: Dict[str, float] = {}
+        self._schedule_changed = asyncio.Event()
+        
+        # Сигнал планировщику автопубликации: избранное, настройки или расписание изменились
+        self._planner_changed = asyncio.Event()
+        
         self.state = self._load_state()
+        self._rebuild_tag_index()
+        self._rebuild_ranking()
+        self._rebuild_schedule()
+        
+        # Сворачиваем доигранный журнал и очистку при загрузке в новый снимок
+        if self._journal_records or self._snapshot_dirty:
+            self.save_state()
     
     def _load_state(self) -> Dict[str, Any]:
         """Загрузка состояния из файла"""
@@ -29,13 +84,15 @@ class StateManager:
                 
                 # Инициализация полей по умолчанию
                 defaults = {
-                    "sent_links": [],
+                    "sent_links": {},
                     "pending": {},
                     "moderation_queue": [],
                     "preview_mode": {},
                     "thoughts_mode": False,
                     "scheduled_posts": {},
                     "generated_images": {},
+                    "file_ids": {},
+                    "outbox": {},
                     "waiting_for_image": None,
                     "current_thought": None,
                     "waiting_for_schedule": None,
@@ -43,6 +100,9 @@ class StateManager:
                     "favorites": [],
                     "auto_publish": False,
                     "publish_interval": 3600,
+                    "quiet_hours": [23, 8],
+                    "channel_rules": [],
+                    "auto_publish_gap": 900,
                     "timezone": settings.default_timezone,
                     "channel": settings.telegram_channel,
                     "waiting_for_channel": False,
@@ -55,28 +115,35 @@ class StateManager:
                     if key not in state:
                         state[key] = default_value
                 
-                # Валидация и миграция данных
+                # Валидация и миграция данных: журнал пишется уже в новом формате
                 self._validate_state(state)
                 
+                # Доигрываем журнал изменений поверх снимка
+                self._replay_journal(state)
+                
                 # Очистка старых постов
                 self.clean_old_posts(state)
                 
                 return state
-                
+        
         except (FileNotFoundError, json.JSONDecodeError) as e:
             logging.info(f"Создаю новый файл состояния: {e}")
-            return self._create_default_state()
+            state = self._create_default_state()
+            self._replay_journal(state)
+            return state
     
     def _create_default_state(self) -> Dict[str, Any]:
         """Создание состояния по умолчанию"""
         return {
-            "sent_links": [],
+            "sent_links": {},
             "pending": {},
             "moderation_queue": [],
             "preview_mode": {},
             "thoughts_mode": False,
             "scheduled_posts": {},
             "generated_images": {},
+            "file_ids": {},
+            "outbox": {},
             "waiting_for_image": None,
             "current_thought": None,
             "waiting_for_schedule": None,
@@ -84,6 +151,9 @@ class StateManager:
             "favorites": [],
             "auto_publish": False,
             "publish_interval": 3600,
+            "quiet_hours": [23, 8],
+            "channel_rules": [],
+            "auto_publish_gap": 900,
             "timezone": settings.default_timezone,
             "channel": settings.telegram_channel,
             "waiting_for_channel": False,
@@ -101,17 +171,188 @@ class StateManager:
             else:
                 logging.warning(f"Удаляю некорректную запись из pending: {uid}")
         state["pending"] = valid_pending
+        
+        # Миграция sent_links из списка в упорядоченный индекс {ссылка: время}
+        sent_links = state.get("sent_links")
+        if isinstance(sent_links, list):
+            migrated_at = datetime.now(timezone.utc).isoformat()
+            state["sent_links"] = {normalize_link(link): migrated_at for link in sent_links}
+            # Снимок на диске еще в старом формате - перезаписываем его
+            self._snapshot_dirty = True
+        if self._evict_sent_links(state["sent_links"]):
+            self._snapshot_dirty = True
     
-    def save_state(self) -> None:
-        """Сохранение состояния в файл"""
+    def _write_snapshot(self, payload: str) -> bool:
+        """Записать снимок и сбросить журнал (в потоке записи)"""
+        tmp_file = f"{self.state_file}.tmp"
         try:
-            with open(self.state_file, "w", encoding="utf-8") as f:
-                json.dump(self.state, f, ensure_ascii=False, indent=2, default=str)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            
+            # Атомарная замена: снимок либо старый, либо новый целиком
+            os.replace(tmp_file, self.state_file)
+            
+            # Все записи журнала теперь в снимке
+            with open(self.journal_file, "w", encoding="utf-8"):
+                pass
+            return True
         except Exception as e:
             logging.error(f"Ошибка при сохранении состояния: {e}")
+            return False
+    
+    def _write_journal(self, payload: str) -> bool:
+        """Дописать записи в журнал (в потоке записи)"""
+        try:
+            with open(self.journal_file, "a", encoding="utf-8") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            return True
+        except Exception as e:
+            logging.error(f"Ошибка записи в журнал состояния: {e}")
+            return False
+    
+    def _take_write(self) -> Optional[Callable[[], bool]]:
+        """Забрать отложенные изменения и подготовить их запись
+        
+        Сериализация идет здесь, в потоке event loop, пока состояние не
+        меняется; поток записи получает готовую строку. Единственный поток
+        записи сохраняет порядок: журнал не допишется после более нового снимка.
+        """
+        journal_full = self._journal_records + len(self._pending_records) >= settings.state_journal_max_records
+        if self._snapshot_dirty or (self._pending_records and journal_full):
+            # Полный снимок, заодно компакция журнала
+            payload = json.dumps(self.state, ensure_ascii=False, indent=2, default=str)
+            self._journal_records = 0
+            self._pending_records = []
+            self._snapshot_dirty = False
+            return partial(self._write_snapshot, payload)
+        
+        if not self._pending_records:
+            return None
+        
+        records, self._pending_records = self._pending_records, []
+        self._journal_records += len(records)
+        payload = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+        return partial(self._write_journal, payload)
+    
+    def save_state(self) -> None:
+        """Сохранение полного снимка состояния и сброс журнала
+        
+        Внутри event loop снимок пишется отложенной записью и не блокирует
+        цикл; вне его - сразу.
+        """
+        self._snapshot_dirty = True
+        self._schedule_flush()
+    
+    def mark_dirty(self) -> None:
+        """Отметить прямое изменение self.state для отложенного снимка"""
+        self._snapshot_dirty = True
+        self._schedule_flush()
+    
+    def flush(self) -> None:
+        """Немедленно записать все отложенные изменения (блокирует вызывающего)
+        
+        Только для кода вне event loop; асинхронный код ждет aflush.
+        """
+        for _ in range(2):
+            write = self._take_write()
+            if write is None or self._writer.submit(write).result():
+                return
+            # Запись не удалась - следующая попытка пишет полный снимок
+            self._snapshot_dirty = True
+    
+    async def aflush(self) -> None:
+        """Записать все отложенные изменения, не блокируя event loop"""
+        for _ in range(2):
+            write = self._take_write()
+            if write is None or await asyncio.wrap_future(self._writer.submit(write)):
+                return
+            self._snapshot_dirty = True
+    
+    async def close(self) -> None:
+        """Дописать отложенные изменения при остановке бота и остановить поток записи"""
+        self._flush_now.set()
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self.aflush()
+        await asyncio.get_running_loop().run_in_executor(None, self._writer.shutdown)
+    
+    def _schedule_flush(self) -> None:
+        """Запланировать запись через окно склейки"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Вне event loop откладывать некуда - пишем сразу
+            self.flush()
+            return
+        
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._delayed_flush())
+    
+    async def _delayed_flush(self) -> None:
+        """Запись после окна склейки изменений или по сигналу остановки"""
+        try:
+            await asyncio.wait_for(self._flush_now.wait(), settings.state_flush_delay_seconds)
+        except asyncio.TimeoutError:
+            pass
+        await self.aflush()
+    
+    def _journal(self, op: str, path: List[str], value: Any = None) -> None:
+        """Добавить изменение в журнал (запись на диск отложена)"""
+        record = {"op": op, "path": path}
+        if op == "set":
+            record["value"] = value
+        
+        self._pending_records.append(record)
+        self._schedule_flush()
+    
+    def _replay_journal(self, state: Dict[str, Any]) -> None:
+        """Применить записи журнала к загруженному снимку"""
+        try:
+            with open(self.journal_file, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Недописанная запись при сбое - дальше журнал не читаем
+                        logging.warning("Обрезанная запись в журнале состояния, пропускаю остаток")
+                        break
+                    self._apply_record(state, record)
+                    self._journal_records += 1
+        except FileNotFoundError:
+            return
+        
+        if self._journal_records:
+            logging.info(f"Доиграно {self._journal_records} записей журнала состояния")
+    
+    @staticmethod
+    def _apply_record(state: Dict[str, Any], record: Dict[str, Any]) -> None:
+        """Применить одну запись журнала"""
+        *parents, key = record["path"]
+        target = state
+        for part in parents:
+            if not isinstance(target, dict):
+                break
+            target = target.setdefault(part, {})
+        
+        if not isinstance(target, dict):
+            logging.warning(f"Пропускаю запись журнала {record['path']}: родитель не словарь")
+            return
+        
+        # set переносит ключ в конец, сохраняя порядок вставки как при записи
+        target.pop(key, None)
+        if record["op"] == "set":
+            target[key] = record["value"]
     
     def clean_old_posts(self, state: Optional[Dict[str, Any]] = None) -> int:
         """Очистка старых постов из очереди"""
+        # При загрузке индексов еще нет: удаляем из словаря, снимок сохранится целиком
+        loading = state is not None
         if state is None:
             state = self.state
         
@@ -128,27 +369,192 @@ class StateManager:
                 age = now - post_date
                 
                 if age.days > settings.max_post_age_days:
-                    del state["pending"][uid]
+                    if loading:
+                        del state["pending"][uid]
+                    else:
+                        # Журнал, индекс тегов, рейтинг и избранное
+                        self.remove_pending_post(uid)
                     removed_count += 1
             except Exception:
                 continue
         
-        # Ограничиваем количество постов
-        if len(state["pending"]) > settings.max_pending_posts:
-            sorted_posts = sorted(
-                state["pending"].items(),
-                key=lambda x: x[1].get("timestamp", ""),
-                reverse=True
-            )
-            
-            state["pending"] = dict(sorted_posts[:settings.max_pending_posts])
-            removed_count += len(sorted_posts) - settings.max_pending_posts
+        # Ограничиваем количество постов, отбрасывая наименее значимые
+        excess = len(state["pending"]) - settings.max_pending_posts
+        if excess > 0:
+            if loading:
+                # Рейтинга еще нет: оцениваем без популярности тегов
+                for uid, _ in heapq.nsmallest(
+                    excess, state["pending"].items(), key=lambda x: self._score(x[1], 0)
+                ):
+                    del state["pending"][uid]
+            else:
+                self._trim_pending()
+            removed_count += excess
         
         if removed_count > 0:
             logging.info(f"Удалено {removed_count} старых постов")
+            if loading:
+                # Очищенное при загрузке состояние попадет в снимок в конце __init__
+                self._snapshot_dirty = True
         
         return removed_count
     
+    # Индекс тегов
+    @staticmethod
+    def _tag_keys(post_data: Dict[str, Any]) -> Set[Tuple[str, str]]:
+        """Ключи индекса для тегов поста"""
+        tags = post_data.get("tags") or {}
+        return {
+            (tag_type, tag)
+            for tag_type, field in TAG_FIELDS.items()
+            for tag in tags.get(field, [])
+        }
+    
+    def _index_post(self, post_data: Dict[str, Any]) -> None:
+        """Добавить пост в индекс тегов"""
+        entry = (post_data.get("timestamp", ""), post_data["id"])
+        for key in self._tag_keys(post_data):
+            bisect.insort(self._tag_index.setdefault(key, []), entry)
+    
+    def _unindex_post(self, post_data: Dict[str, Any]) -> None:
+        """Убрать пост из индекса тегов"""
+        entry = (post_data.get("timestamp", ""), post_data["id"])
+        for key in self._tag_keys(post_data):
+            entries = self._tag_index.get(key, [])
+            position = bisect.bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+            if not entries:
+                self._tag_index.pop(key, None)
+    
+    def _rebuild_tag_index(self) -> None:
+        """Построить индекс тегов по всей очереди"""
+        self._tag_index = {}
+        for post_data in self.state["pending"].values():
+            for key in self._tag_keys(post_data):
+                self._tag_index.setdefault(key, []).append(
+                    (post_data.get("timestamp", ""), post_data["id"])
+                )
+        for entries in self._tag_index.values():
+            entries.sort()
+    
+    def get_pending_tags(self) -> Dict[str, List[str]]:
+        """Все теги постов в очереди, по типам"""
+        result: Dict[str, List[str]] = {field: [] for field in TAG_FIELDS.values()}
+        for tag_type, tag in self._tag_index:
+            result[TAG_FIELDS[tag_type]].append(tag)
+        for tags in result.values():
+            tags.sort()
+        return result
+    
+    def find_pending_ids(self, tags: List[Tuple[str, str]], match_all: bool = True) -> List[str]:
+        """Найти посты по тегам (И / ИЛИ), новые первыми"""
+        lists = [self._tag_index.get(key, []) for key in set(tags)]
+        if not lists:
+            return []
+        
+        if match_all:
+            # Идем по самому короткому списку и проверяем остальные
+            lists.sort(key=len)
+            others = [{post_id for _, post_id in entries} for entries in lists[1:]]
+            return [
+                post_id for _, post_id in reversed(lists[0])
+                if all(post_id in ids for ids in others)
+            ]
+        
+        result = []
+        seen = set()
+        for _, post_id in heapq.merge(*(reversed(entries) for entries in lists), reverse=True):
+            if post_id not in seen:
+                seen.add(post_id)
+                result.append(post_id)
+        return result
+    
+    # Рейтинг очереди
+    def _post_hotness(self, post_data: Dict[str, Any]) -> int:
+        """Сколько других постов в очереди разделяют бренд или модель поста"""
+        counts = [
+            len(self._tag_index.get(key, ())) - 1
+            for key in self._tag_keys(post_data)
+            if key[0] in HOT_TAG_TYPES
+        ]
+        return max(counts, default=0)
+    
+    def _score(self, post_data: Dict[str, Any], hotness: int) -> float:
+        """Оценка значимости поста"""
+        return post_score(
+            post_data,
+            SOURCE_WEIGHTS,
+            hotness,
+            settings.score_half_life_hours,
+            settings.score_hotness_weight
+        )
+    
+    def _rank_post(self, post_data: Dict[str, Any]) -> None:
+        """Добавить проиндексированный пост в рейтинг"""
+        score = self._score(post_data, self._post_hotness(post_data))
+        self._scores[post_data["id"]] = score
+        bisect.insort(self._ranking, (score, post_data["id"]))
+    
+    def _unrank_post(self, post_id: str) -> None:
+        """Убрать пост из рейтинга"""
+        score = self._scores.pop(post_id, None)
+        if score is None:
+            return
+        position = bisect.bisect_left(self._ranking, (score, post_id))
+        if position < len(self._ranking) and self._ranking[position] == (score, post_id):
+            del self._ranking[position]
+    
+    def _rerank_peers(self, *posts_data: Dict[str, Any]) -> None:
+        """Пересчитать оценки постов с тем же брендом или моделью, что у posts_data
+        
+        Популярность тега меняется с каждым добавлением и удалением поста,
+        поэтому после них пересчитываются все затронутые соседи.
+        """
+        peers = {
+            post_id
+            for post_data in posts_data
+            for key in self._tag_keys(post_data)
+            if key[0] in HOT_TAG_TYPES
+            for _, post_id in self._tag_index.get(key, ())
+        }
+        for post_id in peers:
+            self._unrank_post(post_id)
+            self._rank_post(self.state["pending"][post_id])
+    
+    def _rebuild_ranking(self) -> None:
+        """Пересчитать рейтинг всей очереди"""
+        self._scores = {
+            post_id: self._score(post_data, self._post_hotness(post_data))
+            for post_id, post_data in self.state["pending"].items()
+        }
+        self._ranking = sorted((score, post_id) for post_id, score in self._scores.items())
+    
+    def _trim_pending(self) -> None:
+        """Вытеснить наименее значимые посты сверх лимита очереди"""
+        while len(self.state["pending"]) > settings.max_pending_posts and self._ranking:
+            _, post_id = self._ranking[0]
+            logging.info(f"Очередь переполнена, удаляем наименее значимый пост {post_id}")
+            self.remove_pending_post(post_id)
+    
+    def get_post_score(self, post_id: str) -> Optional[float]:
+        """Оценка поста в очереди"""
+        return self._scores.get(post_id)
+    
+    def get_top_pending_ids(
+        self,
+        limit: Optional[int] = None,
+        among: Optional[Set[str]] = None
+    ) -> List[str]:
+        """Посты очереди от самых значимых, при необходимости только из among"""
+        result = []
+        for _, post_id in reversed(self._ranking):
+            if limit is not None and len(result) >= limit:
+                break
+            if among is None or post_id in among:
+                result.append(post_id)
+        return result
+    
     # Методы доступа к состоянию
     def get(self, key: str, default: Any = None) -> Any:
         """Получить значение из состояния"""
@@ -157,18 +563,32 @@ class StateManager:
     def set(self, key: str, value: Any) -> None:
         """Установить значение в состоянии"""
         self.state[key] = value
-        self.save_state()
+        self._journal("set", [key], value)
     
     def update(self, updates: Dict[str, Any]) -> None:
         """Обновить несколько значений"""
         self.state.update(updates)
-        self.save_state()
+        for key, value in updates.items():
+            self._journal("set", [key], value)
+    
+    def update_settings(self, **values: Any) -> None:
+        """Обновить настройки и пересчитать слоты автопубликации"""
+        self.update(values)
+        self._planner_changed.set()
     
     # Специализированные методы
     def add_pending_post(self, post: Post) -> None:
         """Добавить пост в очередь"""
+        previous = self.state["pending"].get(post.id)
+        if previous:
+            self._unindex_post(previous)
+            self._unrank_post(post.id)
         self.state["pending"][post.id] = post.to_dict()
-        self.save_state()
+        self._index_post(self.state["pending"][post.id])
+        self._rank_post(self.state["pending"][post.id])
+        self._rerank_peers(self.state["pending"][post.id], *([previous] if previous else []))
+        self._journal("set", ["pending", post.id], self.state["pending"][post.id])
+        self._trim_pending()
     
     def get_pending_post(self, post_id: str) -> Optional[Post]:
         """Получить пост из очереди"""
@@ -177,29 +597,176 @@ class StateManager:
             return Post.from_dict(post_data)
         return None
     
+    def has_pending_post(self, post_id: str) -> bool:
+        """Проверить, есть ли пост в очереди"""
+        return post_id in self.state["pending"]
+    
+    def get_pending_posts(
+        self,
+        source: Optional[str] = None,
+        category: Optional[str] = None,
+        tag_type: Optional[str] = None,
+        tag_value: Optional[str] = None
+    ) -> List[Post]:
+        """Получить посты из очереди с фильтрами, новые первыми"""
+        if tag_type:
+            records = [self.state["pending"][post_id] for post_id in self.find_pending_ids([(tag_type, tag_value)])]
+        else:
+            records = sorted(
+                self.state["pending"].values(),
+                key=lambda x: x.get("timestamp", ""),
+                reverse=True
+            )
+        
+        return [
+            Post.from_dict(post_data)
+            for post_data in records
+            if (not source or post_data.get("source") == source)
+            and (not category or post_data.get("category") == category)
+        ]
+    
+    def get_post(self, post_id: str) -> Optional[Post]:
+        """Получить пост из очереди или из расписания"""
+        post = self.get_pending_post(post_id)
+        if post:
+            return post
+        
+        scheduled = self.state["scheduled_posts"].get(post_id)
+        if scheduled:
+            return Post.from_dict(scheduled["record"])
+        return None
+    
     def remove_pending_post(self, post_id: str) -> None:
         """Удалить пост из очереди"""
         if post_id in self.state["pending"]:
-            del self.state["pending"][post_id]
-            self.save_state()
+            post_data = self.state["pending"].pop(post_id)
+            self._unindex_post(post_data)
+            self._unrank_post(post_id)
+            self._rerank_peers(post_data)
+            self._journal("del", ["pending", post_id])
+        self.remove_favorite(post_id)
     
     def add_sent_link(self, link: str) -> None:
         """Добавить ссылку в отправленные"""
-        if link not in self.state["sent_links"]:
-            self.state["sent_links"].append(link)
-            # Ограничиваем размер списка
-            if len(self.state["sent_links"]) > 1000:
-                self.state["sent_links"] = self.state["sent_links"][-500:]
-            self.save_state()
+        sent_links = self.state["sent_links"]
+        key = normalize_link(link)
+        
+        # Переносим ссылку в конец, порядок словаря = порядок отправки
+        sent_links.pop(key, None)
+        sent_links[key] = datetime.now(timezone.utc).isoformat()
+        self._journal("set", ["sent_links", key], sent_links[key])
+        
+        for evicted_link in self._evict_sent_links(sent_links):
+            self._journal("del", ["sent_links", evicted_link])
     
     def is_link_sent(self, link: str) -> bool:
         """Проверить, была ли ссылка отправлена"""
-        return link in self.state["sent_links"]
+        return normalize_link(link) in self.state["sent_links"]
+    
+    def _evict_sent_links(self, sent_links: Dict[str, str]) -> List[str]:
+        """Вытеснение самых старых ссылок по возрасту и лимиту размера"""
+        cutoff = (
+            datetime.now(timezone.utc) - timedelta(days=settings.sent_links_max_age_days)
+        ).isoformat()
+        
+        evicted = []
+        while sent_links:
+            oldest_link = next(iter(sent_links))
+            if len(sent_links) <= settings.max_sent_links and sent_links[oldest_link] >= cutoff:
+                break
+            del sent_links[oldest_link]
+            evicted.append(oldest_link)
+        
+        return evicted
+    
+    # Куча расписания
+    def _schedule_push(self, post_id: str, scheduled_post: ScheduledPost) -> None:
+        """Поставить пост в кучу расписания и разбудить планировщик"""
+        try:
+            due = scheduled_post.get_timestamp()
+        except Exception as e:
+            logging.error(f"Некорректное время запланированного поста {post_id}: {e}")
+            return
+        self._schedule_times[post_id] = due
+        heapq.heappush(self._schedule_heap, (due, post_id))
+        self._schedule_changed.set()
+        self._planner_changed.set()
+    
+    def _schedule_discard(self, post_id: str) -> None:
+        """Убрать пост из расписания; запись в куче станет устаревшей"""
+        if self._schedule_times.pop(post_id, None) is not None:
+            self._schedule_changed.set()
+            self._planner_changed.set()
+    
+    def _rebuild_schedule(self) -> None:
+        """Построить кучу по всем запланированным постам"""
+        self._schedule_heap = []
+        self._schedule_times = {}
+        for post_id, scheduled_post in self.get_scheduled_posts().items():
+            self._schedule_push(post_id, scheduled_post)
+    
+    def _schedule_peek(self) -> Optional[Tuple[float, str]]:
+        """Ближайшая актуальная запись кучи"""
+        while self._schedule_heap:
+            due, post_id = self._schedule_heap[0]
+            if self._schedule_times.get(post_id) == due:
+                return due, post_id
+            heapq.heappop(self._schedule_heap)
+        return None
+    
+    def seconds_until_next_scheduled(self) -> Optional[float]:
+        """Секунд до ближайшего запланированного поста, None если расписание пусто"""
+        head = self._schedule_peek()
+        if head is None:
+            return None
+        return max(0.0, head[0] - datetime.now(timezone.utc).timestamp())
+    
+    def pop_due_scheduled(self) -> List[str]:
+        """Забрать из кучи посты, время которых наступило
+        
+        Пост остается в состоянии до remove_scheduled_post; при неудачной
+        публикации его возвращают в кучу через defer_scheduled_post.
+        """
+        now = datetime.now(timezone.utc).timestamp()
+        due_ids = []
+        while True:
+            head = self._schedule_peek()
+            if head is None or head[0] > now:
+                break
+            heapq.heappop(self._schedule_heap)
+            del self._schedule_times[head[1]]
+            due_ids.append(head[1])
+        return due_ids
+    
+    def defer_scheduled_post(self, post_id: str, seconds: float) -> None:
+        """Повторить попытку публикации через seconds, не меняя времени в состоянии"""
+        due = datetime.now(timezone.utc).timestamp() + seconds
+        self._schedule_times[post_id] = due
+        heapq.heappush(self._schedule_heap, (due, post_id))
+        self._schedule_changed.set()
+    
+    def get_scheduled_times(self) -> List[float]:
+        """Время всех запланированных постов по возрастанию"""
+        return sorted(self._schedule_times.values())
+    
+    async def wait_schedule_change(self, timeout: Optional[float]) -> None:
+        """Ждать изменения расписания не дольше timeout секунд"""
+        try:
+            await asyncio.wait_for(self._schedule_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._schedule_changed.clear()
     
     def add_scheduled_post(self, post_id: str, scheduled_post: ScheduledPost) -> None:
         """Добавить запланированный пост"""
         self.state["scheduled_posts"][post_id] = scheduled_post.to_dict()
-        self.save_state()
+        self._journal("set", ["scheduled_posts", post_id], self.state["scheduled_posts"][post_id])
+        self._schedule_push(post_id, scheduled_post)
+    
+    def get_scheduled_post(self, post_id: str) -> Optional[ScheduledPost]:
+        """Получить запланированный пост"""
+        data = self.state["scheduled_posts"].get(post_id)
+        return ScheduledPost.from_dict(data) if data else None
     
     def get_scheduled_posts(self) -> Dict[str, ScheduledPost]:
         """Получить все запланированные посты"""
@@ -215,7 +782,8 @@ class StateManager:
         """Удалить запланированный пост"""
         if post_id in self.state["scheduled_posts"]:
             del self.state["scheduled_posts"][post_id]
-            self.save_state()
+            self._journal("del", ["scheduled_posts", post_id])
+        self._schedule_discard(post_id)
     
     def toggle_favorite(self, post_id: str) -> bool:
         """Переключить избранное"""
@@ -226,9 +794,127 @@ class StateManager:
             self.state["favorites"].append(post_id)
             is_favorite = True
         
-        self.save_state()
+        self._journal("set", ["favorites"], self.state["favorites"])
+        self._planner_changed.set()
         return is_favorite
     
+    def remove_favorite(self, post_id: str) -> None:
+        """Убрать пост из избранного"""
+        if post_id in self.state["favorites"]:
+            self.state["favorites"].remove(post_id)
+            self._journal("set", ["favorites"], self.state["favorites"])
+            self._planner_changed.set()
+    
+    def next_favorite(self) -> Optional[str]:
+        """Первый пост очереди избранного, которого еще ждет публикация
+        
+        Избранное - упорядоченная очередь; id удаленных постов вычищаются
+        при удалении и здесь, поэтому обычно это просто голова списка.
+        """
+        favorites = self.state["favorites"]
+        while favorites and not self.has_pending_post(favorites[0]):
+            logging.info(f"Убираю из избранного недоступный пост {favorites[0]}")
+            self.remove_favorite(favorites[0])
+        return favorites[0] if favorites else None
+    
+    async def wait_planner_change(self, timeout: Optional[float]) -> None:
+        """Ждать изменения избранного, настроек или расписания не дольше timeout секунд"""
+        try:
+            await asyncio.wait_for(self._planner_changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._planner_changed.clear()
+    
     def is_favorite(self, post_id: str) -> bool:
         """Проверить, в избранном ли пост"""
-        return post_id in self.state.get("favorites", [])
\ No newline at end of file
+        return post_id in self.state.get("favorites", [])
+    
+    def add_generated_image(self, post_id: str, image_url: str) -> None:
+        """Добавить сгенерированное изображение к посту"""
+        images = self.state["generated_images"].setdefault(post_id, [])
+        images.append(image_url)
+        self._journal("set", ["generated_images", post_id], images)
+    
+    def get_generated_images(self, post_id: str) -> List[str]:
+        """Получить сгенерированные изображения поста"""
+        return list(self.state["generated_images"].get(post_id, []))
+    
+    def clear_generated_images(self, post_id: str) -> None:
+        """Удалить сгенерированные изображения поста"""
+        if post_id in self.state["generated_images"]:
+            del self.state["generated_images"][post_id]
+            self._journal("del", ["generated_images", post_id])
+    
+    def get_file_id(self, key: str) -> Optional[str]:
+        """Telegram file_id по url или хэшу изображения"""
+        return self.state["file_ids"].get(key)
+    
+    def set_file_id(self, key: str, file_id: str) -> None:
+        """Запомнить file_id, который вернул Telegram после загрузки"""
+        file_ids = self.state["file_ids"]
+        if file_ids.get(key) == file_id:
+            return
+        
+        # Порядок словаря = порядок добавления, старые вытесняются первыми
+        file_ids.pop(key, None)
+        file_ids[key] = file_id
+        self._journal("set", ["file_ids", key], file_id)
+        
+        while len(file_ids) > settings.max_file_ids:
+            oldest_key = next(iter(file_ids))
+            del file_ids[oldest_key]
+            self._journal("del", ["file_ids", oldest_key])
+    
+    # Очередь публикаций
+    def get_outbox_jobs(self) -> Dict[str, Dict[str, Any]]:
+        """Задания публикации по ключу идемпотентности"""
+        return self.state["outbox"]
+    
+    def get_outbox_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Задание публикации"""
+        return self.state["outbox"].get(job_id)
+    
+    def save_outbox_job(self, job: Dict[str, Any]) -> None:
+        """Записать задание публикации"""
+        self.state["outbox"][job["id"]] = job
+        self._journal("set", ["outbox", job["id"]], job)
+    
+    def remove_outbox_job(self, job_id: str) -> None:
+        """Удалить задание публикации"""
+        if self.state["outbox"].pop(job_id, None) is not None:
+            self._journal("del", ["outbox", job_id])
+    
+    def mark_post_as_sent(self, post: Post) -> None:
+        """Отметить пост опубликованным: ссылка в отправленные, пост из очереди"""
+        self.add_sent_link(post.link)
+        self.remove_pending_post(post.id)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика по очереди и публикациям"""
+        brand_stats = {
+            tag: len(entries)
+            for (tag_type, tag), entries in self._tag_index.items()
+            if tag_type == "brand"
+        }
+        source_stats: Dict[str, int] = {}
+        
+        for post_data in self.state["pending"].values():
+            source = post_data.get("source", "Unknown")
+            source_stats[source] = source_stats.get(source, 0) + 1
+        
+        return {
+            "pending_count": len(self.state["pending"]),
+            "sent_count": len(self.state["sent_links"]),
+            "scheduled_count": len(self.state["scheduled_posts"]),
+            "favorites_count": len(self.state.get("favorites", [])),
+            "brand_stats": brand_stats,
+            "source_stats": source_stats
+        }
+
+
+def create_state_manager() -> StateManager:
+    """Создать менеджер состояния с настроенным бэкендом"""
+    if settings.state_backend == "sqlite":
+        from services.sqlite_state_manager import SqliteStateManager
+        return SqliteStateManager(settings.state_file, settings.state_db_file)
+    return StateManager(settings.state_file)
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""
+Near-duplicate story clustering by title similarity
+"""
+import logging
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+from ..config.settings import BotConfig
+from ..models.post import Post
+from ..services.state_manager import StateManager
+from ..utils.minhash import LSHIndex, MinHasher, jaccard
+
+
+# 20 bands x 3 rows: a pair at 0.5 similarity is a candidate with ~93% chance,
+# at 0.6 with ~99%; candidates are then checked by exact Jaccard
+LSH_BANDS = 20
+LSH_ROWS = 3
+
+# Headline filler that differs between feeds covering the same story
+TITLE_STOPWORDS = {
+    "a", "an", "the", "of", "for", "and", "in", "on", "at", "to", "by", "with", "from",
+    "is", "are", "now", "new", "here", "this", "week", "first", "look", "official",
+    "images", "photos", "alert", "available", "where", "how", "buy", "date", "details",
+    "и", "в", "на", "с", "для", "по"
+}
+
+# Tag fields mixed into token sets, with prefixes so "nike" tag != "nike" word
+TAG_TOKENS = (("brands", "brand"), ("models", "model"), ("types", "type"))
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def title_tokens(post: Post) -> Set[str]:
+    """Normalized title words plus extracted tags"""
+    title = post.title.lower().replace("'", "").replace("’", "")
+    tokens = {
+        word for word in _WORD_RE.findall(title)
+        if word not in TITLE_STOPWORDS and (len(word) > 1 or word.isdigit())
+    }
+    if post.tags:
+        for field, prefix in TAG_TOKENS:
+            tokens.update(f"{prefix}:{tag}" for tag in getattr(post.tags, field))
+    return tokens
+
+
+def merge_sources(target: Post, post: Post) -> None:
+    """Record post and the sources merged into it as more sources of target"""
+    known = {target.link} | {entry["link"] for entry in target.duplicates}
+    for entry in [{"source": post.source, "link": post.link}] + post.duplicates:
+        if entry["link"] not in known:
+            known.add(entry["link"])
+            target.duplicates.append(entry)
+
+
+class StoryClusterer:
+    """Collapse the same release reported by several feeds into one post
+    
+    Candidates come from an LSH index over MinHash signatures of title
+    tokens, then are confirmed by exact Jaccard similarity. Posts naming
+    different models are never merged ("Jordan 1 Chicago" vs "Jordan 4 Chicago").
+    """
+    
+    def __init__(self, config: BotConfig, state_manager: StateManager):
+        self.config = config
+        self.state_manager = state_manager
+        self.hasher = MinHasher(LSH_BANDS * LSH_ROWS)
+    
+    @staticmethod
+    def _models_conflict(a: Post, b: Post) -> bool:
+        """Both posts name models and none of them is shared"""
+        a_models = set(a.tags.models) if a.tags else set()
+        b_models = set(b.tags.models) if b.tags else set()
+        return bool(a_models) and bool(b_models) and not a_models & b_models
+    
+    def _find_match(
+        self,
+        index: LSHIndex,
+        signature: Tuple[int, ...],
+        post: Post,
+        tokens: Set[str],
+        entries: Dict[str, Tuple[Post, Set[str]]]
+    ) -> Optional[str]:
+        """Most similar indexed post above threshold"""
+        best_id, best_score = None, self.config.title_cluster_threshold
+        for candidate_id in index.candidates(signature):
+            candidate, candidate_tokens = entries[candidate_id]
+            if self._models_conflict(post, candidate):
+                continue
+            score = jaccard(tokens, candidate_tokens)
+            if score >= best_score:
+                best_id, best_score = candidate_id, score
+        return best_id
+    
+    def _merge(self, target: Post, post: Post) -> None:
+        """Fold duplicate into target: extra images and source link"""
+        for url in post.images:
+            if len(target.images) >= self.config.max_images_per_post:
+                break
+            if url not in target.images:
+                target.images.append(url)
+                if url not in target.original_images:
+                    target.original_images.append(url)
+        
+        if not target.context and post.context:
+            target.context = post.context
+        
+        merge_sources(target, post)
+    
+    def cluster(self, posts: List[Post]) -> List[Post]:
+        """Merge near-duplicates into pending posts or each other
+        
+        Returns the posts that are still new, in input order. Links of
+        merged duplicates are marked as sent so feeds don't bring them back.
+        """
+        index = LSHIndex(LSH_BANDS, LSH_ROWS)
+        entries: Dict[str, Tuple[Post, Set[str]]] = {}
+        
+        for pending in self.state_manager.get_pending_posts():
+            tokens = title_tokens(pending)
+            entries[pending.id] = (pending, tokens)
+            index.add(self.hasher.signature(tokens), pending.id)
+        pending_ids = set(entries)
+        
+        kept: Set[str] = set()
+        changed: Set[str] = set()
+        # Posts with more images go first and become cluster representatives
+        for post in sorted(posts, key=lambda p: len(p.images), reverse=True):
+            tokens = title_tokens(post)
+            signature = self.hasher.signature(tokens)
+            match_id = self._find_match(index, signature, post, tokens, entries)
+            
+            if match_id is None:
+                entries[post.id] = (post, tokens)
+                index.add(signature, post.id)
+                kept.add(post.id)
+                continue
+            
+            target = entries[match_id][0]
+            logging.info(f"Merging near-duplicate story '{post.title}' into '{target.title}'")
+            self._merge(target, post)
+            self.state_manager.add_sent_link(post.link)
+            if match_id in pending_ids:
+                changed.add(match_id)
+        
+        for post_id in changed:
+            self.state_manager.add_pending_post(entries[post_id][0])
+        
+        return [post for post in posts if post.id in kept]
@@ -1,7 +1,8 @@
 """
 Tag extraction service
 """
-from typing import List
+import re
+from typing import Dict, Iterable, List, Set, Tuple
 
 from ..config.constants import (
     BRAND_KEYWORDS, MODEL_KEYWORDS, RELEASE_TYPES, COLOR_KEYWORDS
@@ -9,82 +10,141 @@ from ..config.constants import (
 from ..models.post import PostTags
 
 
-class TagExtractor:
-    """Extract tags from post content"""
+# Map non-English colors to English
+COLOR_MAP = {
+    "черный": "black",
+    "белый": "white",
+    "красный": "red",
+    "синий": "blue",
+    "зеленый": "green",
+    "желтый": "yellow",
+    "фиолетовый": "purple",
+    "розовый": "pink",
+    "оранжевый": "orange",
+    "серый": "gray",
+    "grey": "gray"
+}
+
+
+def _color_table() -> Dict[str, List[str]]:
+    """Every color keyword as its own tag, mapped to English after matching"""
+    return {keyword: [keyword] for keyword in COLOR_KEYWORDS}
+
+
+class KeywordMatcher:
+    """All tag keyword tables compiled into one prefix-trie regex
     
-    @staticmethod
-    def extract_tags(title: str, context: str = "") -> PostTags:
-        """Extract tags from title and context"""
-        text = f"{title} {context}".lower()
+    Matching keeps the semantics of the old per-keyword scan: a keyword
+    fires wherever it occurs in the lowercased text, inside other words
+    included ("990" in "990v5", "aj1" in "aj11"). Keywords are taken
+    verbatim, so "x " and " x " still need the surrounding spaces.
+    
+    The text is scanned once: a zero-width lookahead tries the trie at
+    every position, so overlapping keywords are found too. Only the longest
+    keyword starting at a position is reported, so each keyword carries the
+    tags of every keyword it contains ("air jordan 1" -> jordan, jordan1).
+    """
+    
+    def __init__(self, tables: Dict[str, Dict[str, List[str]]]):
+        self.fields = list(tables)
         
-        tags = PostTags()
+        # Output keeps table order, as with the old per-keyword scan
+        self._rank = {
+            (field, tag): index
+            for field, table in tables.items()
+            for index, tag in enumerate(table)
+        }
         
-        # Extract brands
-        for brand, keywords in BRAND_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in text:
-                    if brand not in tags.brands:
-                        tags.brands.append(brand)
-                    break
+        keyword_tags: Dict[str, Set[Tuple[str, str]]] = {}
+        for field, table in tables.items():
+            for tag, keywords in table.items():
+                for keyword in keywords:
+                    keyword = keyword.lower()
+                    if keyword:
+                        keyword_tags.setdefault(keyword, set()).add((field, tag))
         
-        # Extract models
-        for model, keywords in MODEL_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in text:
-                    if model not in tags.models:
-                        tags.models.append(model)
-                    break
+        self._tags = {
+            keyword: set().union(*(
+                keyword_tags[other] for other in keyword_tags if other in keyword
+            ))
+            for keyword in keyword_tags
+        }
+        self._pattern = re.compile(rf"(?=({self._trie_pattern(self._trie(self._tags))}))")
+    
+    @staticmethod
+    def _trie(keywords: Iterable[str]) -> Dict[str, dict]:
+        """Prefix trie of keywords: one walk down it per position instead of trying every keyword"""
+        trie: Dict[str, dict] = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        return trie
+    
+    @classmethod
+    def _trie_pattern(cls, node: Dict[str, dict]) -> str:
+        """Build regex from trie; longer keywords are tried first"""
+        branches = [
+            re.escape(char) + cls._trie_pattern(child)
+            for char, child in sorted(node.items())
+            if char
+        ]
+        if not branches:
+            # Empty table: a pattern that never matches
+            return "" if node else "(?!)"
         
-        # Extract release types
-        for release_type, keywords in RELEASE_TYPES.items():
-            for keyword in keywords:
-                if keyword in text:
-                    if release_type not in tags.types:
-                        tags.types.append(release_type)
-                    break
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if "" in node:
+            # Keyword may end here; the greedy ? prefers the longer one
+            pattern = f"(?:{pattern})?"
+        return pattern
+    
+    def match(self, text: str) -> Dict[str, List[str]]:
+        """Find tags of every field"""
+        result: Dict[str, List[str]] = {field: [] for field in self.fields}
+        text = text.lower()
         
-        # Extract colors
-        tags.colors = TagExtractor._extract_colors(text)
+        found: Set[Tuple[str, str]] = set()
+        for keyword in set(self._pattern.findall(text)):
+            found |= self._tags[keyword]
         
-        return tags
+        for field, tag in sorted(found, key=self._rank.__getitem__):
+            result[field].append(tag)
+        return result
+
+
+_MATCHER = KeywordMatcher(
+    {
+        "brands": BRAND_KEYWORDS,
+        "models": MODEL_KEYWORDS,
+        "types": RELEASE_TYPES,
+        "colors": _color_table()
+    }
+)
+
+
+class TagExtractor:
+    """Extract tags from post content"""
     
     @staticmethod
-    def _extract_colors(text: str) -> List[str]:
-        """Extract color tags from text"""
-        found_colors = []
-        
-        # Map non-English colors to English
-        color_map = {
-            "черный": "black",
-            "белый": "white",
-            "красный": "red",
-            "синий": "blue",
-            "зеленый": "green",
-            "желтый": "yellow",
-            "фиолетовый": "purple",
-            "розовый": "pink",
-            "оранжевый": "orange",
-            "серый": "gray"
-        }
-        
-        english_colors = [
-            "black", "white", "red", "blue", "green", "yellow", 
-            "purple", "pink", "orange", "grey", "gray"
-        ]
+    def extract_tags(title: str, context: str = "") -> PostTags:
+        """Extract tags from title and context"""
+        found = _MATCHER.match(f"{title} {context}")
         
-        for color in COLOR_KEYWORDS:
-            if color in text:
-                # Map to English if needed
-                english_color = color_map.get(color, color)
-                
-                # Normalize gray/grey
-                if english_color == "grey":
-                    english_color = "gray"
-                
-                if english_color in english_colors and english_color not in found_colors:
-                    found_colors.append(english_color)
+        # Russian color names and "grey" collapse into one English color
+        colors: List[str] = []
+        for keyword in found["colors"]:
+            color = COLOR_MAP.get(keyword, keyword)
+            if color not in colors:
+                colors.append(color)
         
-        return found_colors
+        return PostTags(
+            brands=found["brands"],
+            models=found["models"],
+            types=found["types"],
+            colors=colors
+        )
     
     @staticmethod
     def matches_filter(tags: PostTags, filter_type: str, filter_value: str) -> bool:
@@ -1,6 +1,7 @@
 """
 Text formatting utilities
 """
+import re
 from typing import Dict, List, Optional, TYPE_CHECKING
 from telegram.constants import ParseMode
 
@@ -36,7 +37,7 @@ def get_hashtags_for_post(title: str, category: str) -> str:
     for brand, tags in hashtag_dict.items():
         if brand == "default":
             continue
-            
+        
         # Special cases
         if brand == "jordan" and "air jordan" in title_lower:
             return tags
@@ -149,6 +150,59 @@ def truncate_text(text: str, max_length: int = 1024, suffix: str = "...") -> str
     return text[:max_length - len(suffix)] + suffix
 
 
+# Tag, entity, run of plain text, or a stray "<" / "&"
+_HTML_TOKEN_RE = re.compile(r"<[^>]*>|&#?\w+;|[^<&]+|[<&]")
+_HTML_TAG_RE = re.compile(r"<(/?)([a-zA-Z-]+)")
+
+
+def _visible_length(token: str) -> int:
+    """Characters a token of Telegram HTML leaves after parsing"""
+    if len(token) > 1 and token[0] == "<":
+        return 0
+    if len(token) > 1 and token[0] == "&":
+        return 1
+    return len(token)
+
+
+def truncate_html(text: str, max_length: int = 1024, suffix: str = "...") -> str:
+    """Truncate Telegram HTML to max_length visible characters
+    
+    Telegram limits the text left after parsing: tags do not count and an
+    entity counts as one character. The cut never splits a tag or an
+    entity, and tags left open are closed.
+    """
+    tokens = _HTML_TOKEN_RE.findall(text)
+    if sum(_visible_length(token) for token in tokens) <= max_length:
+        return text
+    
+    budget = max_length - len(suffix)
+    result = []
+    open_tags: List[str] = []
+    for token in tokens:
+        tag = _HTML_TAG_RE.match(token)
+        if tag:
+            closing, name = tag.groups()
+            if not closing:
+                open_tags.append(name.lower())
+            elif open_tags and open_tags[-1] == name.lower():
+                open_tags.pop()
+            result.append(token)
+            continue
+        
+        size = _visible_length(token)
+        if size > budget:
+            # Plain text may be cut, an entity goes whole or not at all
+            if token[0] not in "<&":
+                result.append(token[:budget])
+            break
+        result.append(token)
+        budget -= size
+    
+    result.append(suffix)
+    result.extend(f"</{name}>" for name in reversed(open_tags))
+    return "".join(result)
+
+
 def escape_html(text: str) -> str:
     """Escape HTML special characters"""
     replacements = {
@@ -0,0 +1,98 @@
+"""
+Perceptual image hashing and nearest-hash search
+"""
+import io
+import logging
+from typing import Any, List, Optional, Tuple
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+# dHash grid: HASH_SIZE x HASH_SIZE bits
+HASH_SIZE = 8
+
+
+def dhash(data: bytes) -> Optional[int]:
+    """64-bit difference hash of image, None if it cannot be read
+    
+    Compares neighbouring pixels of a tiny grayscale thumbnail, so it
+    survives resizing, recompression and small crops.
+    """
+    if Image is None:
+        return None
+    
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            pixels = list(
+                image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS).getdata()
+            )
+    except Exception as e:
+        logging.warning(f"Error hashing image: {e}")
+        return None
+    
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    """Number of differing bits"""
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over hashes under Hamming distance
+    
+    A search within distance d only descends into children whose edge
+    distance lies in [dist - d, dist + d], so most of the tree is skipped.
+    """
+    
+    def __init__(self):
+        # Node: [hash, items, {edge distance: child node}]
+        self._root: Optional[list] = None
+        self.size = 0
+    
+    def add(self, value: int, item: Any) -> None:
+        """Add hash with attached item"""
+        self.size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        
+        node = self._root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+    
+    def search(self, value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """Items within max_distance, closest first"""
+        if self._root is None:
+            return []
+        
+        found = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                found.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        
+        found.sort(key=lambda pair: pair[0])
+        return found
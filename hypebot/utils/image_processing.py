@@ -0,0 +1,40 @@
+"""
+Image preprocessing before upload
+"""
+import io
+import logging
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    logging.warning("Pillow is not installed, images are sent as downloaded. Install: pip install Pillow")
+    Image = None
+
+
+def preprocess_image(data: bytes, max_side: int, image_format: str, quality: int) -> bytes:
+    """Downscale and re-encode image, dropping EXIF and other metadata
+    
+    CPU bound, meant to run in a worker thread. Animated GIFs and images
+    Pillow cannot read are returned unchanged.
+    """
+    if Image is None or data.startswith(b"GIF8"):
+        return data
+    
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            # Apply EXIF rotation before the EXIF block is dropped
+            image = ImageOps.exif_transpose(source)
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            
+            if image.mode not in ("RGB", "L"):
+                # Flatten transparency onto white, JPEG has no alpha
+                rgba = image.convert("RGBA")
+                image = Image.new("RGB", rgba.size, "white")
+                image.paste(rgba, mask=rgba.getchannel("A"))
+            
+            output = io.BytesIO()
+            image.save(output, format=image_format, quality=quality, optimize=True)
+            return output.getvalue()
+    except Exception as e:
+        logging.warning(f"Error preprocessing image, sending original: {e}")
+        return data
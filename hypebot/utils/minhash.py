@@ -0,0 +1,80 @@
+"""
+MinHash signatures and LSH banding for near-duplicate text search
+"""
+import hashlib
+import random
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+
+# Mersenne prime above the 32-bit token hash range
+_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    """Exact Jaccard similarity of two sets"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """Fixed family of hash permutations (a * x + b) mod p
+    
+    Two sets agree on a signature slot with probability equal to their
+    Jaccard similarity, so signatures can be compared instead of sets.
+    """
+    
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self._perms = [
+            (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME))
+            for _ in range(num_perm)
+        ]
+    
+    @staticmethod
+    def _token_hash(token: str) -> int:
+        """Stable 32-bit hash of token (str hash is salted per process)"""
+        return int.from_bytes(hashlib.blake2b(token.encode(), digest_size=4).digest(), "big")
+    
+    def signature(self, tokens: Iterable[str]) -> Tuple[int, ...]:
+        """MinHash signature of token set"""
+        hashes = [self._token_hash(token) for token in set(tokens)]
+        if not hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+        return tuple(
+            min((a * value + b) % _PRIME for value in hashes) & _MAX_HASH
+            for a, b in self._perms
+        )
+
+
+class LSHIndex:
+    """Signatures split into bands; items sharing any band are candidates
+    
+    With b bands of r rows a pair with similarity s becomes a candidate
+    with probability 1 - (1 - s^r)^b, a steep curve around (1/b)^(1/r).
+    """
+    
+    def __init__(self, bands: int = 16, rows: int = 4):
+        self.bands = bands
+        self.rows = rows
+        self._buckets: List[Dict[Tuple[int, ...], List[Any]]] = [{} for _ in range(bands)]
+    
+    def _band_keys(self, signature: Tuple[int, ...]) -> Iterable[Tuple[int, Tuple[int, ...]]]:
+        """Band number and slice of signature for every band"""
+        for band in range(self.bands):
+            yield band, signature[band * self.rows:(band + 1) * self.rows]
+    
+    def add(self, signature: Tuple[int, ...], item: Any) -> None:
+        """Add item under its signature"""
+        for band, key in self._band_keys(signature):
+            self._buckets[band].setdefault(key, []).append(item)
+    
+    def candidates(self, signature: Tuple[int, ...]) -> List[Any]:
+        """Items sharing at least one band (items must be hashable)"""
+        found: Dict[Any, None] = {}
+        for band, key in self._band_keys(signature):
+            for item in self._buckets[band].get(key, ()):
+                found.setdefault(item, None)
+        return list(found)
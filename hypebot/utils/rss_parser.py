@@ -0,0 +1,90 @@
+"""
+Streaming RSS/Atom parser
+"""
+from typing import Dict, Iterator, List, Optional
+from xml.etree.ElementTree import Element, XMLPullParser
+
+
+# Item element names (RSS / Atom)
+ITEM_TAGS = ("item", "entry")
+
+# Date fields in order of preference
+DATE_TAGS = ("pubDate", "published", "updated", "date")
+
+# Description fields in order of preference
+DESCRIPTION_TAGS = ("description", "summary", "encoded", "content")
+
+
+def _local_name(tag: str) -> str:
+    """Strip XML namespace from tag"""
+    return tag.rsplit("}", 1)[-1] if "}" in tag else tag
+
+
+class StreamingFeedParser:
+    """Incremental feed parser yielding items as soon as they are complete
+
+    Each finished item is detached from the tree, so memory stays bounded
+    by a single item instead of the whole document.
+    """
+
+    def __init__(self):
+        self._parser = XMLPullParser(events=("start", "end"))
+        self._stack: List[Element] = []
+
+    def feed(self, chunk: bytes) -> Iterator[Dict[str, str]]:
+        """Feed raw bytes and yield completed items"""
+        self._parser.feed(chunk)
+        yield from self._read_items()
+
+    def close(self) -> Iterator[Dict[str, str]]:
+        """Finish parsing and yield remaining items"""
+        self._parser.close()
+        yield from self._read_items()
+
+    def _read_items(self) -> Iterator[Dict[str, str]]:
+        """Drain parser events"""
+        for event, elem in self._parser.read_events():
+            if event == "start":
+                self._stack.append(elem)
+                continue
+
+            self._stack.pop()
+            if _local_name(elem.tag) not in ITEM_TAGS:
+                continue
+
+            item = self._item_to_dict(elem)
+            if self._stack:
+                self._stack[-1].remove(elem)
+            yield item
+
+    @staticmethod
+    def _item_to_dict(elem: Element) -> Dict[str, str]:
+        """Flatten item element into plain fields"""
+        fields: Dict[str, str] = {}
+
+        for child in elem:
+            name = _local_name(child.tag)
+            text = (child.text or "").strip()
+
+            if name == "link":
+                # Atom links carry the url in href
+                link = text or child.get("href", "")
+                if link and child.get("rel", "alternate") == "alternate":
+                    fields.setdefault("link", link)
+            elif text:
+                fields.setdefault(name, text)
+
+        if not fields.get("link") and fields.get("guid", "").startswith("http"):
+            fields["link"] = fields["guid"]
+
+        fields["date"] = _first_field(fields, DATE_TAGS) or ""
+        fields["description"] = _first_field(fields, DESCRIPTION_TAGS) or ""
+        return fields
+
+
+def _first_field(fields: Dict[str, str], names: tuple) -> Optional[str]:
+    """Get first non-empty field from list"""
+    for name in names:
+        if fields.get(name):
+            return fields[name]
+    return None
@@ -0,0 +1,56 @@
+"""
+Relevance scoring of queued posts
+"""
+import math
+from datetime import datetime, timezone
+from typing import Any, Dict, List
+
+
+# Tag types that make a post "hot" when many queued posts share them
+HOT_TAG_TYPES = ("brand", "model")
+
+
+def _timestamp_hours(timestamp: str) -> float:
+    """Hours since epoch of ISO timestamp, naive times are UTC"""
+    try:
+        moment = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        return 0.0
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp() / 3600
+
+
+def source_weights(sources: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Source name -> optional "weight" of source config, 1.0 by default"""
+    return {source["name"]: source.get("weight", 1.0) for source in sources}
+
+
+def post_score(
+    post_data: Dict[str, Any],
+    weights: Dict[str, float],
+    hotness: int,
+    half_life_hours: float,
+    hotness_weight: float
+) -> float:
+    """Relevance of queued post, higher is better
+    
+    This is log2 of recency * source weight * (1 + hotness)^w * cluster size,
+    where recency halves every half_life_hours. The decay is the same for all
+    posts, so it reduces to a linear term in the publication time and time
+    alone never reorders the queue. Hotness does change as posts enter and
+    leave it, so the queue re-scores the posts sharing a brand or model with
+    the post added or removed. One unit equals one half-life of freshness.
+    
+    weights map source names to multipliers, hotness is the number of other
+    queued posts sharing a brand or model tag, cluster size counts the feeds
+    that reported the same story.
+    """
+    weight = weights.get(post_data.get("source"), 1.0)
+    cluster_size = 1 + len(post_data.get("duplicates") or [])
+    return (
+        _timestamp_hours(post_data.get("timestamp", "")) / half_life_hours
+        + math.log2(max(weight, 1e-3))
+        + hotness_weight * math.log2(1 + max(hotness, 0))
+        + math.log2(cluster_size)
+    )
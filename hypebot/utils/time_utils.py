@@ -338,4 +338,20 @@ def parse_date_from_rss(item) -> datetime:
     except Exception as e:
         logging.error(f"Ошибка парсинга RSS даты: {e}")
     
-    return datetime.now(timezone.utc)
\ No newline at end of file
+    return datetime.now(timezone.utc)
+
+def parse_feed_date(date_str: str) -> Optional[datetime]:
+    """Парсинг даты из RSS (RFC 822) или Atom (ISO 8601)"""
+    if not date_str:
+        return None
+    
+    date_str = date_str.strip()
+    try:
+        from email.utils import parsedate_to_datetime
+        parsed = parsedate_to_datetime(date_str)
+    except (TypeError, ValueError):
+        parsed = parse_date_from_string(date_str)
+    
+    if parsed and parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
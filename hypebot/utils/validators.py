@@ -2,10 +2,10 @@
 Validation utilities
 """
 import re
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlunparse, parse_qsl, urlencode
 from typing import Optional
 
-from ..config.constants import VALID_IMAGE_EXTENSIONS
+from ..config.constants import VALID_IMAGE_EXTENSIONS, TRACKING_QUERY_PARAMS
 
 
 def is_valid_image_url(url: str) -> bool:
@@ -21,6 +21,35 @@ def is_valid_image_url(url: str) -> bool:
     return any(parsed.path.lower().endswith(ext) for ext in VALID_IMAGE_EXTENSIONS)
 
 
+def _is_tracking_param(key: str) -> bool:
+    """Check if query parameter only tracks the click"""
+    key = key.lower()
+    return key.startswith("utm_") or key in TRACKING_QUERY_PARAMS
+
+
+def normalize_link(url: str) -> str:
+    """Normalize article link for deduplication"""
+    parsed = urlparse(url.strip())
+    
+    scheme = parsed.scheme.lower()
+    if scheme == "http":
+        scheme = "https"
+    
+    netloc = parsed.netloc.lower()
+    if netloc.startswith("www."):
+        netloc = netloc[4:]
+    
+    # Drop tracking parameters, keep the rest in stable order
+    query = sorted(
+        (key, value)
+        for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not _is_tracking_param(key)
+    )
+    
+    path = parsed.path.rstrip("/") or "/"
+    return urlunparse((scheme, netloc, path, "", urlencode(query), ""))
+
+
 def is_valid_channel(channel: str) -> bool:
     """Check if channel format is valid"""
     if not channel: